@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Benchmark for stat changes on long lists of entities.
+
+Builds the game of life demo board, one mutable cell per location, and times
+REPLACE, += and STAT on every cell at once the way the demo's clear and reset
+moves do.
+
+    python benchmarks/bench_bulk.py [size]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import udebs
+import udebs.basic  # noqa: F401 registers the builtin keywords
+
+game = """
+<udebs>
+<config><logging>False</logging><immutable>True</immutable><revert>10</revert></config>
+<definitions><stats><NBR /><LIFE /></stats></definitions>
+<maps><map type="diag"><dim><x>{size}</x><y>{size}</y></dim></map></maps>
+<entities>
+    <cell immutable="False" />
+    <cells />
+    <clear><effect><i>all = ALL.cells</i><i>$all NBR REPLACE 0</i><i>$all LIFE REPLACE 1</i></effect></clear>
+    <bump><effect>ALL.cells NBR += 1</effect></bump>
+    <init>
+        <effect>
+            <i>all = FILL.(0 0)</i>
+            <i>#cell RECRUIT $all</i>
+            <i>#$all group GETS cells</i>
+        </effect>
+    </init>
+</entities>
+</udebs>
+"""
+
+
+def main(size=100, number=20):
+    field = udebs.battleStart(game.format(size=size))
+    cells = field.getAll("cells")
+
+    for move in ("clear", "bump"):
+        total = timeit.timeit(lambda: field.castMove("empty", "empty", move, time=0), number=number)
+        print(f"{move:>5}: {len(cells)} cells, {total / number * 1e3:.2f} ms per cast")
+
+    assert field.getStat(cells, "LIFE") == [1] * len(cells)
+    total = timeit.timeit(lambda: field.getStat(cells, "NBR"), number=number)
+    print(f" STAT: {len(cells)} cells, {total / number * 1e3:.2f} ms per call")
+
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:2]))
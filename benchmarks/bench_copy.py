@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark for node expansion in tree search.
+
+Builds a board full of mutable units and expands a node the way
+State.substates does: copy the instance, then cast a move that changes
+two units. Compares eager copies, copy on write (cow) copies and
+applying the move in place then undoing it (State.inplace_substates).
+
+    python benchmarks/bench_copy.py [size]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import udebs
+import udebs.basic  # noqa: F401 registers the builtin keywords
+
+game = """
+<udebs>
+<config><logging>False</logging><immutable>False</immutable></config>
+<definitions>
+    <stats><HP /></stats>
+    <lists><tags /></lists>
+</definitions>
+<maps><map><dim><x>{size}</x><y>{size}</y></dim></map></maps>
+<entities>
+    <unit><HP>10</HP><tags>alive</tags></unit>
+    <hit><effect><i>$caster HP -= 1</i><i>$target HP -= 1</i></effect></hit>
+    <init><effect>#unit RECRUIT FILL.(0 0)</effect></init>
+</entities>
+</udebs>
+"""
+
+
+def expand(field):
+    new = field.copy()
+    new.castMove("unit1", "unit2", "hit", time=0)
+    return new
+
+
+def main(size=30, number=200):
+    results = {}
+    for cow in (False, True):
+        field = udebs.battleStart(game.format(size=size), cow=cow)
+        child = expand(field)
+        results[cow] = (child["unit1"].HP, child["unit2"].HP, field["unit1"].HP)
+
+        total = timeit.timeit(lambda: expand(field), number=number)
+        print(f"{'cow' if cow else 'eager':>5}: {len(field)} entities, {total / number * 1e3:.3f} ms per node")
+
+    field = udebs.battleStart(game.format(size=size))
+    token = field.castMove("unit1", "unit2", "hit", time=0, undoable=True)
+    assert (field["unit1"].HP, field["unit2"].HP) == results[False][:2]
+    field.undo(token)
+    assert field["unit1"].HP == results[False][2]
+
+    total = timeit.timeit(lambda: field.undo(field.castMove("unit1", "unit2", "hit", time=0, undoable=True)),
+                          number=number)
+    print(f" undo: {len(field)} entities, {total / number * 1e3:.3f} ms per node")
+
+    assert results[False] == results[True]
+
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:2]))
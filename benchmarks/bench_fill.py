@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark for flood fill on a large board.
+
+Fills a 200x200 board from its centre for each board type, once with the
+precomputed neighbour tables (Board.get_fill) and once recomputing every
+neighbour and testing it with test_loc, the way get_adjacent used to.
+Also fills through the FILL keyword, which tests a callback on every cell,
+on a board covered in immutable terrain where each kind of tile is tested once.
+
+    python benchmarks/bench_fill.py [size]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import udebs
+import udebs.basic  # noqa: F401 registers the builtin keywords
+from udebs.board import Board, sides
+
+game = """
+<udebs>
+<config><logging>False</logging></config>
+<definitions><stats><COST /></stats></definitions>
+<maps><map><dim><x>{size}</x><y>{size}</y></dim></map></maps>
+<entities>
+    <grass immutable=""><COST>1</COST></grass>
+    <swamp immutable=""><COST>3</COST></swamp>
+    <wall immutable=""><COST>9</COST></wall>
+    <unit />
+    <walkable><require><i>$target.NAME != wall</i><i>($target STAT COST) &lt; 5</i></require></walkable>
+    <init>
+        <effect>
+            <i>#grass RECRUIT FILL.(0 0)</i>
+            <i>#swamp RECRUIT (FILL (10 10) #empty true 5)</i>
+            <i>#wall RECRUIT (FILL ({half} 0) #empty true 3)</i>
+            <i>#unit RECRUIT (0 0)</i>
+        </effect>
+    </init>
+</entities>
+</udebs>
+"""
+
+
+def recompute_fill(board, center):
+    found = {center}
+    new = {center}
+    while new:
+        next_ = set()
+        for child in new:
+            for x_, y_ in sides[:board.count]:
+                loc = (child[0] + x_, child[1] + y_, board.name)
+                if loc not in found:
+                    found.add(loc)
+                    if board.test_loc(loc):
+                        next_.add(loc)
+        new = next_
+    return {i for i in found if board.test_loc(i)}
+
+
+def main(size=200, number=5):
+    center = (size // 2, size // 2, "map")
+    for type_ in (False, "hex", "diag"):
+        board = Board(dim=(size, size), type=type_)
+        build = timeit.timeit(lambda: board.neighbours, number=1)
+        assert board.get_fill(center) == recompute_fill(board, center)
+
+        table = timeit.timeit(lambda: board.get_fill(center), number=number) / number
+        plain = timeit.timeit(lambda: recompute_fill(board, center), number=number) / number
+        print(f"{type_ or 'square':>6}: table built in {build * 1e3:.1f} ms, "
+              f"{len(board) / table / 1e6:.2f} M cells/s with tables, "
+              f"{len(board) / plain / 1e6:.2f} M cells/s recomputing")
+
+    field = udebs.battleStart(game.format(size=size, half=size // 2))
+    fill = field.getFill(field["unit1"], field["walkable"])
+    total = timeit.timeit(lambda: field.getFill(field["unit1"], field["walkable"]), number=1)
+    print(f"  FILL: {len(fill)} cells on terrain with a callback, {len(fill) / total / 1e3:.1f} k cells/s")
+
+
+if __name__ == "__main__":
+    main(*(int(i) for i in sys.argv[1:2]))
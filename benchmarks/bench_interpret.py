@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the udebs script compiler.
+
+Compares the single pass parser in udebs.interpret against the recursive
+split_callstring implementation it replaced, over every script found in the
+demos and the test suite. Both implementations must produce identical python.
+
+    python benchmarks/bench_interpret.py
+"""
+import glob
+import os
+import re
+import sys
+import timeit
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import udebs.basic  # noqa: F401 registers the builtin keywords
+from udebs import errors, interpret
+from udebs.interpret import Variables, call
+
+root = os.path.join(os.path.dirname(__file__), "..")
+
+
+# ---------------------------------------------------
+#          Reference implementation (1.1.1)        -
+# ---------------------------------------------------
+def split_callstring(raw):
+    open_bracket = {'(', '{', '['}
+    close_bracket = {')', '}', ']'}
+    call_list = []
+    buf = ''
+    in_brackets = 0
+    in_quotes = False
+    dot_legal = True
+
+    for char in raw.strip():
+
+        if char in {'"', "'"}:
+            in_quotes = not in_quotes
+
+        elif not in_quotes:
+            if char in open_bracket:
+                in_brackets += 1
+
+            elif char in close_bracket:
+                in_brackets -= 1
+
+            elif not in_brackets:
+                if dot_legal:
+                    if char == ".":
+                        call_list.append(buf)
+                        buf = ''
+                        continue
+
+                    elif char.isspace():
+                        dot_legal = False
+                        if call_list:
+                            call_list = [".".join(call_list) + "." + buf]
+                            buf = ''
+
+                if char.isspace():
+                    if buf:
+                        call_list.append(buf)
+                        buf = ''
+                    continue
+
+        buf += char
+    call_list.append(buf)
+
+    if in_brackets:
+        raise errors.UdebsSyntaxError(f"Brackets are mismatched. '{raw}'")
+
+    if '' in call_list:
+        raise errors.UdebsSyntaxError(f"Empty element in call_list. '{raw}'")
+
+    if len(call_list) == 1:
+        value = call_list[0]
+        if value not in Variables.modules:
+            if value[0] in Variables.modules:
+                return [value[0], value[1:]]
+
+    return call_list
+
+
+def legacy_interpret(string, root=False):
+    found = []
+    for entry in split_callstring(string):
+        if entry[0] == "(" and entry[-1] == ")":
+            found.append(legacy_interpret(entry[1:-1]))
+        elif "." in entry:
+            found.append(legacy_interpret(entry))
+        elif entry[0] in Variables.modules and entry not in Variables.modules:
+            found.append(legacy_interpret(entry))
+        else:
+            found.append(entry)
+
+    return call(found, root=root)
+
+
+# ---------------------------------------------------
+#                  Script corpus                   -
+# ---------------------------------------------------
+def xml_scripts(text):
+    found = []
+    for node in ElementTree.fromstring(text).iter():
+        if node.tag in {"require", "effect"}:
+            children = list(node)
+            for item in children if children else [node]:
+                if item.text and item.text.strip():
+                    found.append(item.text)
+    return found
+
+
+def corpus():
+    scripts = []
+    for path in glob.glob(os.path.join(root, "demos", "*.py")):
+        with open(path) as f:
+            for block in re.findall(r'"""\s*(<udebs>.*?</udebs>)\s*"""', f.read(), re.S):
+                scripts.extend(xml_scripts(block))
+
+    with open(os.path.join(root, "udebs", "tests", "test.xml")) as f:
+        scripts.extend(xml_scripts(f.read()))
+
+    with open(os.path.join(root, "udebs", "tests", "test_interpret.py")) as f:
+        scripts.extend(re.findall(r'(?:castSingle|interpret)\(\s*"([^"]*)"', f.read()))
+
+    # Deeply nested synthetic script, the worst case for the recursive parser.
+    nested = "1"
+    for _ in range(40):
+        nested = f"+ ({nested}) (max 1 2 length.(3 4))"
+    scripts.append(nested)
+
+    return scripts
+
+
+def main(number=200):
+    pairs = []
+    for script in corpus():
+        try:
+            expected = legacy_interpret(script, root=True)
+        except (errors.UdebsSyntaxError, RecursionError):
+            continue
+
+        result = interpret.interpret(script, root=True)
+        if result != expected:
+            raise AssertionError(f"output differs for {script!r}\n{expected}\n{result}")
+        pairs.append(script)
+
+    print(f"{len(pairs)} scripts produce identical output")
+
+    for name, f in (("recursive", legacy_interpret), ("single pass", interpret.interpret)):
+        total = timeit.timeit(lambda: [f(i, root=True) for i in pairs], number=number)
+        print(f"{name:>12}: {total / number * 1000:.3f} ms per corpus")
+
+    deep = pairs[-1]
+    for name, f in (("recursive", legacy_interpret), ("single pass", interpret.interpret)):
+        total = timeit.timeit(lambda: f(deep, root=True), number=number)
+        print(f"{name:>12}: {total / number * 1000:.3f} ms nested script")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Micro benchmark for getter specialization in the udebs compiler.
+
+Compiles STAT heavy scripts twice, once without a schema (generic getStat
+calls) and once with the schema of the instance they run in (stat kind
+specific getters). Both versions must return the same values.
+
+    python benchmarks/bench_specialize.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import udebs
+import udebs.basic  # noqa: F401 registers the builtin keywords
+from udebs.interpret import Script
+
+game = """
+<udebs>
+<config><logging>False</logging></config>
+<definitions>
+    <stats><HP /><ATK /><DEF /></stats>
+    <lists><tags rlist='' /></lists>
+    <strings><DESC /></strings>
+</definitions>
+<entities>
+    <base><HP>10</HP><DESC>a unit</DESC></base>
+    <armoured><DEF>3</DEF></armoured>
+    <soldier>
+        <group><i>base</i><i>armoured</i></group>
+        <ATK>4</ATK>
+        <tags>veteran</tags>
+    </soldier>
+    <veteran><ATK>1</ATK></veteran>
+</entities>
+</udebs>
+"""
+
+scripts = {
+    "STAT": "+ (#soldier STAT HP) (#soldier STAT ATK) (#soldier STAT DEF) ($caster STAT HP) ($caster STAT ATK)",
+    "mixed": "(#soldier STAT HP) > ((#veteran STAT ATK) - ($caster STAT DEF))",
+    "lists": "== (#soldier GROUP) ($caster STAT tags) (#veteran STAT tags)",
+}
+
+
+def main(number=20000):
+    env = udebs.battleStart(game)
+    local = {"storage": {"caster": env["soldier"]}, "self": env}
+
+    for name, string in scripts.items():
+        generic = Script(string, registry=env.registry)
+        special = Script(string, registry=env.registry, schema=env.schema)
+
+        expected = eval(generic.code, env.registry.env, local)
+        assert eval(special.code, env.registry.env, local) == expected
+
+        times = []
+        for script in (generic, special):
+            total = timeit.timeit(lambda: eval(script.code, env.registry.env, local), number=number)
+            times.append(total / number * 1e6)
+
+        print(f"{name:>6}: generic {times[0]:.2f} us, specialized {times[1]:.2f} us, "
+              f"{times[0] / times[1]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
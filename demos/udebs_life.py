@@ -14,6 +14,7 @@ game_config = """
 
 <config>
     <revert>10</revert>
+    <keyframe>10</keyframe>
     <logging>False</logging>
     <name>life</name>
     <immutable>True</immutable>
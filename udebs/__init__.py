@@ -8,4 +8,4 @@ from udebs.utilities import *
 from udebs.errors import *
 from udebs.instance import Instance
 from udebs.entity import Entity
-from udebs.board import Board
+from udebs.board import ArrayBoard, Board
@@ -6,53 +6,65 @@ log = logging.getLogger(__name__)
 Variables.modules.update({
     "min": {
         "f": "min",
-        "all": True
+        "all": True,
+        "pure": True
     },
     "max": {
         "f": "max",
-        "all": True
+        "all": True,
+        "pure": True
     },
     "|": {
         "f": "abs",
-        "args": ["$1"]
+        "args": ["$1"],
+        "pure": True
     },
     "length": {
         "f": "len",
-        "args": ["$1"]
+        "args": ["$1"],
+        "pure": True
     },
     ">": {
         "f": "operator.gt",
-        "args": ["-$1", "$1"]
+        "args": ["-$1", "$1"],
+        "pure": True
     },
     "<": {
         "f": "operator.lt",
-        "args": ["-$1", "$1"]
+        "args": ["-$1", "$1"],
+        "pure": True
     },
     ">=": {
         "f": "operator.ge",
-        "args": ["-$1", "$1"]
+        "args": ["-$1", "$1"],
+        "pure": True
     },
     "<=": {
         "f": "operator.le",
-        "args": ["-$1", "$1"]
+        "args": ["-$1", "$1"],
+        "pure": True
     },
     "%": {
         "f": "operator.mod",
-        "args": ["-$1", "$1"]
+        "args": ["-$1", "$1"],
+        "pure": True
     },
     "/": {
         "f": "operator.floordiv",
         "args": ["-$1", "$1"],
-        "default": {"-$1": 1}
+        "default": {"-$1": 1},
+        "pure": True
     },
     "!": {
         "f": "operator.not_",
-        "args": ["$1"]
+        "args": ["$1"],
+        "pure": True
     },
     "-": {
         "f": "operator.sub",
         "args": ["-$1", "$1"],
-        "default": {"-$1": 0}
+        "default": {"-$1": 0},
+        "pure": True
     },
     "$": {
         "f": "storage.__getitem__",
@@ -78,22 +90,54 @@ def print_inner(*args):
     return True
 
 
-@register({"args": ["$1", "$2", "$3"], "default": {"$2": True, "$3": False}}, name="if")
+@register({"args": ["$1", "$2", "$3"], "default": {"$2": True, "$3": False}, "lazy": ["$2", "$3"], "pure": True},
+          name="if")
 def logicif(cond, value, other):
     """
     returns value if condition else other.
 
-    (Note, this function evaluates all conditions regardless of if condition.)
-    (Deprecated in version 1.1.0 in favor of AND, OR blocks.)
+    (Note, only the chosen branch is evaluated.)
 
     .. code-block:: xml
 
         <i>if cond value other</i>
     """
-    return value if cond else other
+    return value() if cond else other()
+
+
+@register({"all": True, "lazy": True, "pure": True}, name="&&")
+def logicand(*args):
+    """
+    Returns True if all arguments are true. Stops evaluating at the first false argument.
+
+    .. code-block:: xml
+
+        <i>cond1 && cond2</i>
+        <i>&& cond1 cond2 ...</i>
+    """
+    for arg in args:
+        if not arg():
+            return False
+    return True
+
+
+@register({"all": True, "lazy": True, "pure": True}, name="||")
+def logicor(*args):
+    """
+    Returns True if any argument is true. Stops evaluating at the first true argument.
+
+    .. code-block:: xml
+
+        <i>cond1 || cond2</i>
+        <i>|| cond1 cond2 ...</i>
+    """
+    for arg in args:
+        if arg():
+            return True
+    return False
 
 
-@register({"args": ["-$1", "$1", "$2"], "default": {"$2": 1}}, name="in")
+@register({"args": ["-$1", "$1", "$2"], "default": {"$2": 1}, "pure": True}, name="in")
 def inside(before, after, amount=1):
     """
     Returns true if before in after amount times else false.
@@ -118,7 +162,7 @@ def inside(before, after, amount=1):
     return False
 
 
-@register({"args": ["-$1", "$1", "$2"], "default": {"$2": 1}}, name="not-in")
+@register({"args": ["-$1", "$1", "$2"], "default": {"$2": 1}, "pure": True}, name="not-in")
 def notin(*args, **kwargs):
     """
     Returns false if value in obj else true.
@@ -130,7 +174,7 @@ def notin(*args, **kwargs):
     return not inside(*args, **kwargs)
 
 
-@register({"all": True}, name="==")
+@register({"all": True, "pure": True}, name="==")
 def equal(*args):
     """Checks for equality of args.
 
@@ -146,7 +190,7 @@ def equal(*args):
     return True
 
 
-@register({"all": True}, name="!=")
+@register({"all": True, "pure": True}, name="!=")
 def notequal(*args):
     """Checks for inequality of args.
 
@@ -162,7 +206,7 @@ def notequal(*args):
     return True
 
 
-@register({"all": True}, name="+")
+@register({"all": True, "pure": True}, name="+")
 def plus(*args):
     """Sums arguments
 
@@ -174,12 +218,12 @@ def plus(*args):
     return sum(args)
 
 
-@register(["$1"], name="sum")
+@register({"args": ["$1"], "pure": True}, name="sum")
 def sumation(arg):
     return sum(arg)
 
 
-@register({"all": True}, name="*")
+@register({"all": True, "pure": True}, name="*")
 def multiply(*args):
     """Multiplies arguments
 
@@ -210,7 +254,7 @@ def setvar(storage, variable, value):
     return True
 
 
-@register(["-$1", "$1"], name="elem")
+@register({"args": ["-$1", "$1"], "pure": True}, name="elem")
 def sub(array, i):
     """Gets the ith element of array.
 
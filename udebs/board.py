@@ -1,7 +1,12 @@
+from array import array
 from collections.abc import MutableMapping
+from functools import lru_cache
 from typing import Iterator
+import heapq
 import math
 
+from udebs.utilities import hash_key
+
 sides = [
     (-1, 0),
     (0, 1),
@@ -13,6 +18,50 @@ sides = [
     (-1, -1),
 ]
 
+# Distance metric of each board type by number of sides. Used as the astar heuristic.
+metrics = {4: "p1", 6: "hex", 8: "pinf"}
+
+
+def _adjacent(x: int, y: int, name: str, width: int, height: int, count: int) -> tuple[tuple, ...]:
+    """Locations next to (x, y) that are on a width by height board, in the order of sides."""
+    found = []
+    for x_, y_ in sides[:count]:
+        if 0 <= x + x_ < width and 0 <= y + y_ < height:
+            found.append((x + x_, y + y_, name))
+    return tuple(found)
+
+
+class Neighbours:
+    """
+    Precomputed adjacency of one board shape.
+
+    Locations are numbered x * height + y. locs maps numbers back to locations,
+    index maps locations to numbers and adjacent holds the numbers next to each number.
+    """
+    __slots__ = ("name", "x", "y", "count", "locs", "index", "adjacent")
+
+    def __init__(self, name: str, x: int, y: int, count: int):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.count = count
+        self.locs = tuple((i, j, name) for i in range(x) for j in range(y))
+        self.index = {loc: i for i, loc in enumerate(self.locs)}
+        self.adjacent = tuple(self._compute(loc) for loc in self.locs)
+
+    def _compute(self, loc: tuple) -> tuple[int, ...]:
+        return tuple(self.index[i] for i in _adjacent(loc[0], loc[1], self.name, self.x, self.y, self.count))
+
+    def ids(self, loc: tuple) -> tuple[int, ...]:
+        """Numbers of the locations next to loc. loc does not have to be on the board."""
+        i = self.index.get(loc)
+        return self._compute(loc) if i is None else self.adjacent[i]
+
+
+@lru_cache(maxsize=32)
+def _neighbours(name: str, x: int, y: int, count: int) -> Neighbours:
+    return Neighbours(name, x, y, count)
+
 
 class Board(MutableMapping):
     """This is a test."""
@@ -44,6 +93,10 @@ class Board(MutableMapping):
 
         self.x = len(self.map)
         self.y = max([len(x) for x in self.map])
+        # Rows this board may change in place. None when rows are never shared, see copy.
+        self._owned = None
+        # Hash of every occupied cell, kept up to date once getHash is called.
+        self._hash = None
 
     def __eq__(self, other) -> bool:
         if not isinstance(other, Board):
@@ -66,6 +119,10 @@ class Board(MutableMapping):
         x, y = key[0], key[1]
         if x >= 0:
             if y >= 0:
+                if self._owned is not None and x not in self._owned:
+                    self._ownRow(x)
+                if self._hash is not None:
+                    self._hash ^= self._cellHash(x, y, self.map[x][y]) ^ self._cellHash(x, y, value)
                 self.map[x][y] = value
                 return
         raise IndexError
@@ -74,6 +131,10 @@ class Board(MutableMapping):
         x, y = key[0], key[1]
         if x >= 0:
             if y >= 0:
+                if self._owned is not None and x not in self._owned:
+                    self._ownRow(x)
+                if self._hash is not None:
+                    self._hash ^= self._cellHash(x, y, self.map[x][y])
                 self.map[x][y] = self.empty
                 return
         raise IndexError
@@ -92,18 +153,63 @@ class Board(MutableMapping):
     def __copy__(self) -> "Board":
         return self.copy()
 
-    def copy(self) -> "Board":
+    def copy(self, cow: bool = False) -> "Board":
+        """
+        Returns a copy of this board.
+
+        If cow is True rows are shared with the copy and copied by whichever board writes to them first.
+        """
         options = {}
         for k, v in self.__dict__.items():
             if k == "map":
-                v = [i[:] for i in self.map]
+                v = self.map[:] if cow else [i[:] for i in self.map]
             options[k] = v
 
+        if cow:
+            # Neither board owns its rows anymore.
+            self._owned = set()
+            options["_owned"] = set()
+        else:
+            options["_owned"] = None
+
         return Board(_data=options)
 
+    def _cellHash(self, x: int, y: int, value: str) -> int:
+        return 0 if value == self.empty else hash_key(self.name, x, y, value)
+
+    def getHash(self) -> int:
+        """Returns a 64 bit hash of the board's contents. Updated on every change once computed."""
+        if self._hash is None:
+            value = 0
+            for x, row in enumerate(self.map):
+                for y, cell in enumerate(row):
+                    if cell != self.empty:
+                        value ^= hash_key(self.name, x, y, cell)
+            self._hash = value
+        return self._hash
+
+    def _ownRow(self, x: int) -> None:
+        """Replaces a shared row with a private copy."""
+        self.map[x] = self.map[x][:]
+        self._owned.add(x)
+
     # ---------------------------------------------------
     #                    Methods                       -
     # ---------------------------------------------------
+    @property
+    def neighbours(self) -> Neighbours:
+        """
+        Adjacency table used by the path finding methods.
+
+        The table depends only on name, size and type, so it is built once and shared by every copy.
+        """
+        return _neighbours(self.name, self.x, self.y, self.count)
+
+    def adjacent(self, loc: tuple) -> tuple[tuple, ...]:
+        """Returns the locations next to loc that are on this board."""
+        table = self.neighbours
+        return tuple(table.locs[i] for i in table.ids(loc))
+
     def show(self) -> None:
         """Pretty prints a map."""
         maxi = 0
@@ -168,45 +274,65 @@ class Board(MutableMapping):
         callback - callback to filter cells
 
         """
-        if not isinstance(start, set):
-            new = {start}
-        else:
-            new = start
+        new = start if isinstance(start, set) else {start}
+        yield new
 
-        start = state.getEntity(start)
-        searched = set()
-        searched.update(new)
+        locs = self.neighbours.locs
+        for ring in self._rings(start, sort, pointer, state, callback):
+            yield {locs[i] for i in ring}
 
-        while len(new) > 0:
-            yield new
+    def _rings(self, start: tuple | set[tuple], sort=None, pointer=None, state=None,
+               callback=None) -> Iterator[set[int]]:
+        """
+        Same as get_adjacent, except the circles after start are sets of location numbers, see Neighbours.
+        """
+        new = start if isinstance(start, set) else {start}
+        allows = self._filter(state, callback, start)
+
+        table = self.neighbours
+        locs, adjacent = table.locs, table.adjacent
+        searched = {table.index[loc] for loc in new if loc in table.index}
+        # (location, numbers of the locations next to it) for every location in the current circle.
+        children = [(loc, table.ids(loc)) for loc in new]
 
+        while True:
             next_ = set()
-            for child in new:
-                for x_, y_ in sides[:self.count]:
-                    loc = (child[0] + x_, child[1] + y_, self.name)
-                    if loc not in searched:
-                        searched.add(loc)
-                        if self.test_loc(loc):
-                            if callback:
-                                env = {"storage": {
-                                    "caster": start,
-                                    "target": state.getEntity(loc),
-                                    "move": callback
-                                }, "self": state}
-                                if callback.test(env) is not None:
-                                    continue
-                            next_.add(loc)
+            if callback or pointer:
+                for child, ids in children:
+                    for i in ids:
+                        if i not in searched:
+                            searched.add(i)
+                            loc = locs[i]
+                            if callback and not allows(loc):
+                                continue
+                            next_.add(i)
                             if pointer:
                                 pointer[loc] = child
-            new = next_
+            else:
+                # Nothing to filter or record, whole circles can be found with set operations.
+                for _, ids in children:
+                    next_.update(ids)
+                next_ -= searched
+                searched |= next_
+
+            if not next_:
+                return
+            yield next_
+
             if sort:
-                new = sort(new)
+                children = [(loc, table.ids(loc)) for loc in sort({locs[i] for i in next_})]
+            else:
+                children = [(locs[i], adjacent[i]) for i in next_]
 
-    def get_path(self, start: tuple, finish: tuple, **kwargs) -> list[tuple]:
+    def get_path(self, start: tuple, finish: tuple, method: str = None, **kwargs) -> list[tuple]:
         """
         Algorithm to find a path between start and finish assuming callback.
 
         start, finish - Start and finish locations.
+        method - Search to use. "bfs" (default), "astar" or "bidirectional".
+
+        All methods return a shortest path. astar uses the distance metric matching the board type
+        as its heuristic and bidirectional searches from both ends until they meet.
 
         Returns empty list if there is no path.
 
@@ -214,24 +340,137 @@ class Board(MutableMapping):
         if not isinstance(finish, set):
             finish = {finish}
 
-        pointer = {i: None for i in start}
+        starts = start if isinstance(start, set) else {start}
+        final = finish.intersection(starts)
+        if final:
+            return [final.pop()]
+
+        if method is None or method == "bfs":
+            return self._bfs_path(start, starts, finish, **kwargs)
+        elif method == "astar":
+            return self._astar_path(start, starts, finish, **kwargs)
+        elif method == "bidirectional":
+            return self._bidirectional_path(start, starts, finish, **kwargs)
+        else:
+            raise ValueError(f"{method} is an invalid search method")
+
+    @staticmethod
+    def _trace(pointer: dict, loc: tuple) -> list[tuple]:
+        """Follows pointer back from loc. Returns the locations from loc to the start of the search."""
+        found = [loc]
+        while pointer[loc] is not None:
+            loc = pointer[loc]
+            found.append(loc)
+        return found
 
-        # Populate pointer.
-        for i in self.get_adjacent(start, pointer=pointer, **kwargs):
-            final = finish.intersection(i)
+    def _bfs_path(self, start, starts, finish, **kwargs) -> list[tuple]:
+        pointer = {i: None for i in starts}
+
+        table = self.neighbours
+        targets = {table.index[loc] for loc in finish if loc in table.index}
+        for i in self._rings(start, pointer=pointer, **kwargs):
+            final = targets.intersection(i)
             if len(final) > 0:
-                break
-        else:
+                found = self._trace(pointer, table.locs[final.pop()])
+                found.reverse()
+                return found
+
+        return []
+
+    def _astar_path(self, start, starts, finish, state=None, callback=None, **kwargs) -> list[tuple]:
+        allows = self._filter(state, callback, start)
+
+        metric = metrics[self.count]
+        goals = [loc for loc in finish if loc in self.neighbours.index]
+        if not goals:
             return []
 
-        new = final.pop()
-        found = [new]
-        while pointer[new]:
-            new = pointer[new]
-            found.append(new)
+        def estimate(loc):
+            return min(self.get_distance(loc, goal, metric) for goal in goals)
+
+        pointer = {i: None for i in starts}
+        cost = {i: 0 for i in starts}
+        # Entries are (estimated length, -cost, tie breaker, location). Deeper entries go first on ties.
+        queue = [(estimate(loc), 0, i, loc) for i, loc in enumerate(starts)]
+        heapq.heapify(queue)
+        counter = len(queue)
+        closed = set()
+
+        while queue:
+            loc = heapq.heappop(queue)[3]
+            if loc in closed:
+                continue
+            if loc in finish:
+                found = self._trace(pointer, loc)
+                found.reverse()
+                return found
+
+            closed.add(loc)
+            g = cost[loc] + 1
+            for new in self.adjacent(loc):
+                if new in closed or cost.get(new, g + 1) <= g:
+                    continue
+
+                if allows(new):
+                    cost[new] = g
+                    pointer[new] = loc
+                    counter += 1
+                    heapq.heappush(queue, (g + estimate(new), -g, counter, new))
+
+        return []
+
+    def _bidirectional_path(self, start, starts, finish, state=None, callback=None, **kwargs) -> list[tuple]:
+        allows = self._filter(state, callback, start)
+        targets = [loc for loc in finish if loc in self.neighbours.index and allows(loc)]
+
+        # Pointers and distances towards start (forward) and towards finish (backward).
+        sides_ = [({i: None for i in starts}, {i: 0 for i in starts}, list(starts)),
+                  ({i: None for i in targets}, {i: 0 for i in targets}, targets)]
+
+        while sides_[0][2] and sides_[1][2]:
+            # Grow the smaller frontier by one full circle.
+            side = 0 if len(sides_[0][2]) <= len(sides_[1][2]) else 1
+            pointer, dist, frontier = sides_[side]
+            other, other_dist, _ = sides_[1 - side]
+
+            best = None
+            next_ = []
+            for loc in frontier:
+                for new in self.adjacent(loc):
+                    if new in pointer:
+                        continue
+                    if new in other:
+                        length = dist[loc] + 1 + other_dist[new]
+                        if best is None or length < best[0]:
+                            best = (length, loc, new)
+                    elif allows(new):
+                        pointer[new] = loc
+                        dist[new] = dist[loc] + 1
+                        next_.append(new)
+
+            if best is not None:
+                _, loc, new = best
+                if side:
+                    loc, new = new, loc
+                found = self._trace(sides_[0][0], loc)
+                found.reverse()
+                return found + self._trace(sides_[1][0], new)
+
+            sides_[side] = (pointer, dist, next_)
+
+        return []
+
+    @staticmethod
+    def _filter(state, callback, start):
+        """
+        Returns a function testing if callback allows a search from start into a loc.
 
-        found.reverse()
-        return found
+        Each search builds one, see Instance.searchFilter. Every loc is tested at most once.
+        """
+        if not callback:
+            return lambda loc: True
+
+        return state.searchFilter(callback, state.getEntity(start))
 
     def get_fill(self, center: tuple, distance: float = float("inf"),
                  include_center: bool = True, **kwargs) -> set[tuple]:
@@ -244,18 +483,118 @@ class Board(MutableMapping):
 
         """
         found = set()
-        count = 0
-        for i in self.get_adjacent(center, **kwargs):
-            found.update(i)
-            if count >= distance:
-                break
-            count += 1
+        if distance >= 1:
+            for count, i in enumerate(self._rings(center, **kwargs), 1):
+                found |= i
+                if count >= distance:
+                    break
+
+        locs = self.neighbours.locs
+        found = {locs[i] for i in found}
+        if include_center:
+            found.update(center if isinstance(center, set) else {center})
+
+        return found
+
+    def get_costs(self, start: tuple | set[tuple], cost, limit: float = float("inf"), **kwargs) -> dict[tuple, float]:
+        """
+        Returns the lowest total cost of reaching every location within limit of start.
+
+        start - Starting loc or set of locs.
+        cost - Function taking a loc, returns the cost of moving into it. Costs must not be negative.
+        limit - Maximum total cost.
+
+        """
+        return self._dijkstra(start, cost, limit, **kwargs)[0]
+
+    def get_weighted_path(self, start: tuple, finish: tuple, cost, **kwargs) -> list[tuple]:
+        """
+        Finds the path between start and finish with the lowest total cost.
+
+        start, finish - Start and finish locations.
+        cost - Function taking a loc, returns the cost of moving into it. Costs must not be negative.
+
+        Returns empty list if there is no path.
 
+        """
+        if not isinstance(finish, set):
+            finish = {finish}
+
+        _, pointer, end = self._dijkstra(start, cost, finish=finish, **kwargs)
+        if end is None:
+            return []
+
+        found = self._trace(pointer, end)
+        found.reverse()
+        return found
+
+    def get_weighted_fill(self, center: tuple, cost, limit: float = float("inf"),
+                          include_center: bool = True, **kwargs) -> set[tuple]:
+        """
+        Returns a set of map spaces reachable from center for at most limit total cost.
+
+        center - Starting loc
+        cost - Function taking a loc, returns the cost of moving into it. Costs must not be negative.
+        limit - Maximum total cost.
+        include_center - Boolean to determine if center should be included.
+
+        """
+        found = set(self.get_costs(center, cost, limit, **kwargs))
         if not include_center:
-            found.remove(center)
+            found.difference_update(center if isinstance(center, set) else {center})
 
         return found
 
+    def _dijkstra(self, start, cost, limit=float("inf"), finish=None, state=None, callback=None):
+        """
+        Heap based Dijkstra search from start, stopping early once a location in finish is reached.
+
+        Returns (totals, pointer, end). totals maps every location reached to its lowest total cost,
+        pointer maps locations to the location before them and end is the location of finish
+        reached or None.
+        """
+        starts = start if isinstance(start, set) else {start}
+        allows = self._filter(state, callback, start)
+
+        totals = {}
+        pointer = {i: None for i in starts}
+        best = {i: 0 for i in starts}
+        # Cost of moving into each location seen so far, None if it is not allowed.
+        steps = {}
+        # Entries are (total cost, tie breaker, location).
+        queue = [(0, i, loc) for i, loc in enumerate(starts)]
+        counter = len(queue)
+
+        while queue:
+            total, _, loc = heapq.heappop(queue)
+            if loc in totals:
+                continue
+
+            totals[loc] = total
+            if finish is not None and loc in finish:
+                return totals, pointer, loc
+
+            for new in self.adjacent(loc):
+                if new in totals:
+                    continue
+
+                if new not in steps:
+                    step = cost(new) if allows(new) else None
+                    if step is not None and step < 0:
+                        raise ValueError(f"{new} has a negative movement cost {step}")
+                    steps[new] = step
+
+                step = steps[new]
+                if step is not None:
+                    new_total = total + step
+                    if new_total <= limit and new_total < best.get(new, math.inf):
+                        best[new] = new_total
+                        pointer[new] = loc
+                        counter += 1
+                        heapq.heappush(queue, (new_total, counter, new))
+
+        return totals, pointer, None
+
     def test_loc(self, loc: tuple) -> bool:
         """
         Test a loc to see if it is valid.
@@ -283,17 +622,122 @@ class Board(MutableMapping):
         start, finish - Starting and finishing locations.
 
         """
+        if max_dist is None:
+            max_dist = float("inf")
+
         if start == finish and max_dist > 0:
             return True
 
-        i = self.get_adjacent(finish)
-        next(i)
-        final = next(i)
-        for dist, i in enumerate(self.get_adjacent(start, **kwargs)):
-            if i.intersection(final):
-                return True
+        table = self.neighbours
+        final = set(table.ids(finish))
+        if table.index.get(start) in final:
+            return True
+
+        if max_dist > 1:
+            for dist, i in enumerate(self._rings(start, **kwargs), 1):
+                if i & final:
+                    return True
 
-            if dist + 1 >= max_dist:
-                return False
+                if dist + 1 >= max_dist:
+                    return False
 
         return False
+
+
+class ArrayBoard(Board):
+    """
+    Board storing cells as integer ids in one contiguous array instead of a list of lists.
+
+    Entity names are interned into ids shared by every copy of the board. Copies are a single
+    buffer copy, or free with cow=True, and view returns the ids as a read only numpy array.
+
+    Select it with store="array" in the map options, <map store="array"> in xml.
+
+    Note: Rows of uneven length are padded with empty.
+    """
+
+    def __init__(self, **options):
+        if "_data" in options:
+            # second path for copy operation only
+            self.__dict__ = options["_data"]
+            return
+
+        board = Board(**options)
+        rows = board.__dict__.pop("map")
+        self.__dict__.update(board.__dict__)
+        self.store = "array"
+
+        self.names = [self.empty]
+        self.ids = {self.empty: 0}
+        self.cells = array("i", [0]) * (self.x * self.y)
+        self._shared = False
+        for x, row in enumerate(rows):
+            for y, name in enumerate(row):
+                self.cells[x * self.y + y] = self._id(name)
+
+    def _id(self, name: str) -> int:
+        """Returns the id of name, adding it if needed."""
+        value = self.ids.get(name)
+        if value is None:
+            value = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return value
+
+    @property
+    def map(self) -> list[list[str]]:
+        """Cells as a list of rows of entity names. Changing it does not change the board."""
+        names = self.names
+        return [[names[i] for i in self.cells[x * self.y:(x + 1) * self.y]] for x in range(self.x)]
+
+    def __getitem__(self, key: tuple) -> str:
+        x, y = key[0], key[1]
+        if 0 <= x < self.x and 0 <= y < self.y:
+            return self.names[self.cells[x * self.y + y]]
+        raise IndexError
+
+    def __setitem__(self, key: tuple, value: str) -> None:
+        x, y = key[0], key[1]
+        if 0 <= x < self.x and 0 <= y < self.y:
+            if self._shared:
+                self.cells = array("i", self.cells)
+                self._shared = False
+            index = x * self.y + y
+            if self._hash is not None:
+                self._hash ^= self._cellHash(x, y, self.names[self.cells[index]]) ^ self._cellHash(x, y, value)
+            self.cells[index] = self._id(value)
+            return
+        raise IndexError
+
+    def __delitem__(self, key: tuple) -> None:
+        self[key] = self.empty
+
+    def copy(self, cow: bool = False) -> "ArrayBoard":
+        """
+        Returns a copy of this board.
+
+        If cow is True the buffer is shared with the copy and copied by whichever board writes first.
+        """
+        options = dict(self.__dict__)
+        if cow:
+            self._shared = True
+            options["_shared"] = True
+        else:
+            options["cells"] = array("i", self.cells)
+            options["_shared"] = False
+
+        return ArrayBoard(_data=options)
+
+    def view(self):
+        """
+        Returns the cells as a read only numpy array of ids with shape (x, y). names maps ids back to entity names.
+
+        Requires numpy.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("ArrayBoard.view requires numpy to be installed.")
+
+        value = numpy.frombuffer(self.cells, dtype=numpy.intc).reshape(self.x, self.y)
+        value.flags.writeable = False
+        return value
@@ -0,0 +1,97 @@
+"""
+Precompiled script bundles.
+
+A bundle stores the interpreted source and compiled code of every script in a game
+so later calls to battleStart can skip interpreting and compiling them.
+
+Bundles are keyed by a hash of the xml and a signature of every registered keyword.
+A bundle that does not match is ignored and rebuilt.
+
+Note: Bundles contain marshalled code objects. Only load bundles you created yourself.
+"""
+import hashlib
+import importlib.util
+import marshal
+import os
+
+from udebs.interpret import Schema, Script, Variables, script_cache
+
+FORMAT = 2
+
+
+def signature(registry=Variables) -> str:
+    """Hash of the registered keywords. Scripts compiled under another signature may be wrong."""
+    digest = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+    for name in sorted(registry.modules):
+        digest.update(repr((name, sorted(registry.modules[name].items()))).encode())
+    return digest.hexdigest()
+
+
+def content_hash(xml_file) -> str:
+    """Hash of the xml given to battleStart, either a file name or the xml itself."""
+    try:
+        with open(xml_file, "rb") as f:
+            content = f.read()
+    except (OSError, TypeError, ValueError):
+        content = str(xml_file).encode()
+    return hashlib.sha256(content).hexdigest()
+
+
+def _scripts(field):
+    """Yields every script used by the entities of field."""
+    for entity in field.values():
+        for stat in ("require", "effect"):
+            for script in getattr(entity, stat):
+                if isinstance(script, Script):
+                    yield script
+
+
+def dump(path: str, key: tuple, field) -> bool:
+    """Writes the scripts of field to a bundle file. Returns False if it could not be written."""
+    scripts = {}
+    for script in _scripts(field):
+        schema = None if script.schema is None else tuple(script.schema)
+        if script.raw is None:
+            scripts[(script.interpret, True, schema)] = (script.interpret, script.code)
+        else:
+            scripts[(script.raw, False, schema)] = (script.interpret, script.code)
+
+    data = marshal.dumps((FORMAT, key, [(k, v) for k, v in scripts.items()]))
+
+    # Write then rename so other processes never read a partial bundle.
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def load(path: str, key: tuple, registry=Variables) -> bool:
+    """Loads a bundle into the script cache. Returns False if it is missing, damaged or stale."""
+    try:
+        with open(path, "rb") as f:
+            version, found, scripts = marshal.load(f)
+
+        if version != FORMAT or tuple(found) != tuple(key):
+            return False
+
+        entries = []
+        for (effect, skip_interpret, schema), (source, code) in scripts:
+            if schema is not None:
+                schema = Schema(*schema)
+            entries.append(((registry.version, effect, skip_interpret, schema), (source, code)))
+    except (OSError, EOFError, ValueError, TypeError):
+        return False
+
+    # Only fill the cache once the whole bundle has been read.
+    for cache_key, compiled in entries:
+        script_cache.put(cache_key, compiled)
+
+    return True
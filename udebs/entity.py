@@ -1,18 +1,27 @@
+from functools import lru_cache
+from keyword import iskeyword
+from operator import attrgetter
 from udebs import errors, interpret
-from udebs.interpret import Variables
 from typing import Optional
 
 
 class Entity:
-    def __init__(self, field=None, debug=None, **options):
-        if "_data" in options:
-            # second path for copy operation only
-            self.__dict__ = options["_data"]
-            return
+    """
+    Entity(field, **options) returns an instance of the class built for field's schema, see entity_class.
+    """
+    __slots__ = ()
+
+    # Attribute names shared by every entity of a schema. Lists are copied one level deep.
+    _schema = None
+    other = frozenset()
+    lists = frozenset()
 
-        self.other = {"name", "immutable", "loc"}
-        self.lists = set()
+    def __new__(cls, field=None, debug=None, **options):
+        if cls is Entity:
+            cls = entity_class(field.schema)
+        return object.__new__(cls)
 
+    def __init__(self, field=None, debug=None, **options):
         # Get base special data
         self.immutable = options.get("immutable", field.immutable)
         self.loc = None
@@ -27,22 +36,19 @@ class Entity:
         # Set the stats
         for stat in field.stats:
             setattr(self, stat, int(options.get(stat, 0)))
-            self.other.add(stat)
         for lists in field.lists.union({"group"}):
             value = options.get(lists, [])
             if not isinstance(value, list):
                 value = [value]
             setattr(self, lists, value)
-            self.lists.add(lists)
         for string in field.strings:
             setattr(self, string, options.get(string, None))
-            self.other.add(string)
 
         # Transform effect and require into scripts
         for stat_list in [self.effect, self.require]:
             for i, elem in enumerate(stat_list):
                 if isinstance(elem, str):
-                    stat_list[i] = interpret.Script(elem, debug=debug)
+                    stat_list[i] = interpret.Script(elem, debug, registry=field.registry, schema=field.schema)
 
         # Set loc.
         if not self.immutable:
@@ -56,7 +62,7 @@ class Entity:
         if not isinstance(other, Entity):
             return False
 
-        return self.__dict__ == other.__dict__
+        return type(self) is type(other) and self._state(self) == other._state(other)
 
     def __len__(self):
         return 1
@@ -74,9 +80,17 @@ class Entity:
     #                 Call Functions                    -
     # ---------------------------------------------------
     def test(self, env: dict) -> Optional[str]:
+        state = env["self"]
+        if state.profiler is not None:
+            return state.profiler.test(self, env)
+        elif state.fuse:
+            fused = state._getFused(self)
+            if fused is not None:
+                return fused(state, env["storage"], effects=False)
+
         for require in env["self"].getStat(self, 'require'):
             try:
-                value = eval(require.code, Variables.env, env)
+                value = eval(require.code, state.registry.env, env)
             except RecursionError:
                 raise
             except Exception:
@@ -86,14 +100,22 @@ class Entity:
                 return require
 
     def __call__(self, env: dict, force: bool = False) -> Optional[str]:
+        state = env["self"]
+        if state.profiler is not None:
+            return state.profiler.call(self, env, force)
+        elif state.fuse:
+            fused = state._getFused(self)
+            if fused is not None:
+                return fused(state, env["storage"], force=force)
+
         if not force:
             value = self.test(env)
             if value is not None:
                 return value
 
-        for effect in env["self"].getStat(self, 'effect'):
+        for effect in state.getStat(self, 'effect'):
             try:
-                eval(effect.code, Variables.env, env)
+                eval(effect.code, state.registry.env, env)
             except Exception:
                 raise errors.UdebsExecutionError(effect)
 
@@ -102,15 +124,50 @@ class Entity:
     # ---------------------------------------------------
     def copy(self, **kwargs) -> "Entity":
         """Make a copy of this entity for use in other instances."""
-        kwargs["other"] = self.other
-        kwargs["lists"] = self.lists
-
+        new = object.__new__(type(self))
         for k in self.other:
-            if k not in kwargs:
-                kwargs[k] = self.__dict__[k]
-
+            setattr(new, k, getattr(self, k))
         for k in self.lists:
-            if k not in kwargs:
-                kwargs[k] = self.__dict__[k][:]
-
-        return Entity(_data=kwargs)
+            setattr(new, k, getattr(self, k)[:])
+        for k, v in kwargs.items():
+            setattr(new, k, v)
+        return new
+
+    def __reduce__(self):
+        return _rebuild, (self._schema, self._state(self))
+
+
+@lru_cache(maxsize=None)
+def entity_class(schema: interpret.Schema) -> type:
+    """
+    Returns the Entity class for instances with schema.
+
+    Attributes are stored in __slots__ and copy is compiled for the layout, so a copy is one
+    assignment per attribute. Names that can not be slots fall back to a __dict__ and the generic copy.
+    """
+    other = frozenset({"name", "immutable", "loc"}) | schema.stats | schema.strings
+    lists = schema.lists | {"group"}
+    fields = tuple(sorted(other)) + tuple(sorted(lists))
+
+    namespace = {"_schema": schema, "other": other, "lists": lists, "_state": attrgetter(*fields), "_fields": fields}
+    if all(k.isidentifier() and not iskeyword(k) for k in fields):
+        namespace["__slots__"] = fields
+        lines = ["def copy(self, **kwargs):", "    new = _new(type(self))"]
+        lines += [f"    new.{k} = self.{k}" for k in sorted(other)]
+        lines += [f"    new.{k} = self.{k}[:]" for k in sorted(lists)]
+        lines += ["    for k, v in kwargs.items():", "        setattr(new, k, v)", "    return new"]
+        scope = {"_new": object.__new__}
+        exec("\n".join(lines), scope)
+        scope["copy"].__doc__ = Entity.copy.__doc__
+        namespace["copy"] = scope["copy"]
+
+    return type("Entity", (Entity,), namespace)
+
+
+def _rebuild(schema, state):
+    """Unpickles an entity, see Entity.__reduce__."""
+    cls = entity_class(schema)
+    new = object.__new__(cls)
+    for k, v in zip(cls._fields, state):
+        setattr(new, k, v)
+    return new
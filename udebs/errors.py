@@ -4,13 +4,19 @@ class UdebsError(Exception):
 
 
 class UdebsSyntaxError(UdebsError):
-    """Is raised when an effect or require is malformed and fails to parse."""
+    """Is raised when an effect or require is malformed and fails to parse.
 
-    def __init__(self, string):
+    pos - Index into the source string where the error was found, if known.
+    """
+
+    def __init__(self, string, pos=None):
         self.message = string
+        self.pos = pos
 
     def __str__(self):
-        return repr(self.message)
+        if self.pos is None:
+            return repr(self.message)
+        return f"{self.message!r} at position {self.pos}"
 
 
 class UdebsExecutionError(UdebsError):
@@ -0,0 +1,195 @@
+"""
+Revert history for Instance.
+
+Instead of a full copy per tick, the history stores a keyframe (a full copy) every
+few ticks and, in between, only what changed during each tick. The changes are
+collected from the journal the control methods write to, see Instance.undo.
+
+Old states are rebuilt on demand by Instance.getRevert.
+
+Deltas are opt-in: set keyframe above 1 to use them. The default stores a full copy
+every tick. On the 100x100 life demo with revert 10 and keyframe 10 the history takes
+about a quarter of the memory, since half the board changes every tick.
+
+Note: With keyframe above 1, only changes made through the control methods are recorded.
+Entities changed directly from python in between keyframes are reverted wrongly.
+"""
+from udebs.entity import Entity
+
+
+class Delta:
+    """Everything one tick changed, stored as new values."""
+    __slots__ = ("entities", "attrs", "cells", "time", "cont", "value", "rand", "delays", "added")
+
+    def __init__(self, instance, records):
+        # Entity name -> whether it existed when the tick started.
+        entities = {}
+        # Value each attribute and cell had when the tick started.
+        attrs = {}
+        cells = {}
+
+        for record in records:
+            kind = record[0]
+            if kind in ("attr", "list"):
+                if isinstance(record[1], Entity):
+                    attrs.setdefault((record[1].name, record[2]), record[3])
+            elif kind == "board":
+                cells.setdefault((record[1].name, record[2]), record[3])
+            elif kind == "item":
+                entities.setdefault(record[1], record[2] is not None)
+
+        # Entity name -> copy of the entity, or None if it was deleted.
+        self.entities = {}
+        # Number of entities added minus number deleted.
+        self.added = 0
+        for name, existed in entities.items():
+            entity = instance.get(name)
+            self.added += (entity is not None) - existed
+            if entity is not None and not entity.immutable:
+                entity = entity.copy()
+            self.entities[name] = entity
+
+        # (entity name, attribute) -> value, for attributes that ended the tick changed.
+        self.attrs = {}
+        for (name, attr), old in attrs.items():
+            if name not in self.entities and name in instance:
+                value = getattr(instance[name], attr)
+                if value != old:
+                    self.attrs[name, attr] = value[:] if isinstance(value, list) else value
+
+        # (map name, location) -> entity name
+        self.cells = {}
+        for (map_, loc), old in cells.items():
+            value = instance.map[map_][loc]
+            if value != old:
+                self.cells[map_, loc] = value
+
+        self.time = instance.time
+        self.cont = instance.cont
+        self.value = instance.value
+        self.rand = instance.rand.getstate()
+        self.delays = [(delay["script"], delay["ticks"], delay["env"]) for delay in instance.delay]
+
+    def __len__(self):
+        return len(self.entities) + len(self.attrs) + len(self.cells)
+
+    def apply(self, instance) -> None:
+        """Changes instance to the state this delta was taken from."""
+        for name, entity in self.entities.items():
+            if entity is None:
+                dict.pop(instance, name, None)
+            else:
+                instance[name] = entity if entity.immutable else entity.copy()
+                if instance._owned is not None:
+                    instance._owned.add(name)
+
+        for (name, attr), value in self.attrs.items():
+            entity = instance[name]
+            if instance._owned is not None:
+                entity = instance._own(entity)
+            setattr(entity, attr, value[:] if isinstance(value, list) else value)
+
+        for (map_, loc), value in self.cells.items():
+            instance.map[map_][loc] = value
+
+        instance.time = self.time
+        instance.cont = self.cont
+        instance.value = self.value
+        instance.rand.setstate(self.rand)
+        instance._fused = {}
+        instance._groups = {}
+        instance._resetLineage()
+
+        instance.delay = []
+        for script, ticks, env in self.delays:
+            new = dict(env)
+            new["self"] = instance
+            new["storage"] = {k: instance[v.name] for k, v in env["storage"].items()}
+            instance.delay.append({"env": new, "ticks": ticks, "script": script})
+
+
+class History:
+    """
+    Last size states of an instance, one per tick.
+
+    Every interval ticks, or whenever a tick changes most of the game, a keyframe is stored.
+    """
+
+    def __init__(self, size: int, interval: int = 10, frames: list = None):
+        self.size = size
+        self.interval = interval
+        # Each frame is either a keyframe (an Instance) or a Delta on the frame before it.
+        self.frames = [] if frames is None else frames
+        # Entities in the instance when the last frame was stored.
+        self.length = None
+        self.since = 0
+        for frame in reversed(self.frames):
+            if not isinstance(frame, Delta):
+                break
+            self.since += 1
+
+    def __len__(self):
+        return min(len(self.frames), self.size)
+
+    def copy(self) -> "History":
+        new = History(self.size, self.interval, self.frames[:])
+        new.length = self.length
+        return new
+
+    def record(self, instance) -> None:
+        """Stores the current state of instance and starts collecting the next tick."""
+        journal = instance._journal
+        frame = None
+        if journal is not None and self.frames and self.since + 1 < self.interval:
+            frame = Delta(instance, journal[instance._mark:])
+            # Entities added or deleted from python are not in the journal.
+            if len(frame) > len(instance) or self.length + frame.added != len(instance):
+                frame = None
+
+        if frame is None:
+            frame = instance.copy()
+            self.since = 0
+        else:
+            self.since += 1
+
+        self.frames.append(frame)
+        self.length = len(instance)
+
+        # Frames up to the second keyframe can go once enough newer frames exist.
+        while True:
+            for i in range(1, len(self.frames)):
+                if not isinstance(self.frames[i], Delta):
+                    break
+            else:
+                break
+
+            if len(self.frames) - i < self.size:
+                break
+            del self.frames[:i]
+
+        if journal is not None:
+            if instance._open:
+                instance._mark = len(journal)
+            else:
+                journal.clear()
+                instance._mark = 0
+
+    def get(self, time: int):
+        """Rebuilds the state from time ticks ago. Returns None if it is no longer stored."""
+        if time + 1 > len(self):
+            return None
+
+        end = len(self.frames) - 1 - time
+        start = end
+        while isinstance(self.frames[start], Delta):
+            start -= 1
+
+        new = self.frames[start].copy()
+        for delta in self.frames[start + 1:end + 1]:
+            delta.apply(new)
+
+        new.state = History(self.size, self.interval, self.frames[:end + 1])
+        new.state.length = len(new)
+        new._journal = [] if self.interval > 1 else None
+        new._zobrist = None
+        return new
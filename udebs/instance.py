@@ -3,14 +3,18 @@ from itertools import product
 from random import Random
 from typing import Any, Optional
 
-from udebs.board import Board
+from udebs import trace
+from udebs.board import ArrayBoard, Board
 from udebs.entity import Entity
-from udebs.errors import UndefinedSelectorError
-from udebs.interpret import Script, register, Variables
-from udebs.utilities import no_recurse
+from udebs.errors import UdebsExecutionError, UndefinedSelectorError
+from udebs.history import History
+from udebs.interpret import Schema, Script, entity_only, register, Variables, fuse
+from udebs.profiler import Profiler
+from udebs.utilities import hash_key, no_recurse
 from numbers import Number
 
-info = logging.getLogger().info
+logger = logging.getLogger()
+info = logger.info
 
 
 Variables.modules.update({
@@ -29,22 +33,102 @@ Variables.modules.update({
 })
 
 
-def _getStatRmap(state, target, stat):
-    yield from _getStatInheritance(state, target, stat)
+def _rmapUnits(state, target):
+    yield target
 
     # rmap only apply to current object not rlist.
     if target.loc:
         for map_ in state.rmap:
             if map_ != target.loc[2]:
-                child = state[state.map[map_][target.loc]]
-                yield from _getStatInheritance(state, child, stat)
+                yield state[state.map[map_][target.loc]]
 
 
-def _getStatInheritance(state, target, stat):
-    yield getattr(target, stat)
-    for lst in state.rlist:
-        for unit in getattr(target, lst):
-            yield from _getStatInheritance(state, state[unit], stat)
+_missing = object()
+
+
+def _chain(values):
+    return tuple(i for j in values for i in j)
+
+
+def _first(values):
+    for i in values:
+        if i is not None:
+            return i
+
+
+def _inherited(state, target, stat, combine):
+    """Returns combine of stat over every entity target inherits from, see Instance._ancestors."""
+    key = (target.name, stat)
+    value = state._inherited.get(key, _missing)
+    if value is _missing:
+        names, fixed = state._ancestors(target)
+        value = combine(getattr(state[unit], stat) for unit in names)
+        if fixed:
+            state._inherited[key] = value
+    return value
+
+
+def _sumInheritance(state, target, stat):
+    return getattr(target, stat) + _inherited(state, target, stat, sum)
+
+
+def _sumColumn(state, targets, stat):
+    """_getStatSum for every entity in a list without rmap, reading the inheritance cache directly."""
+    cache = state._inherited
+    values = []
+    for target in targets:
+        if isinstance(target, list):
+            values.append(_sumColumn(state, target, stat))
+            continue
+
+        inherited = cache.get((target.name, stat), _missing)
+        if inherited is _missing:
+            inherited = _inherited(state, target, stat, sum)
+        values.append(getattr(target, stat) + inherited)
+    return values
+
+
+def _listInheritance(state, target, stat):
+    return [*getattr(target, stat), *_inherited(state, target, stat, _chain)]
+
+
+def _stringInheritance(state, target, stat):
+    value = getattr(target, stat)
+    return _inherited(state, target, stat, _first) if value is None else value
+
+
+# Specialized versions of Instance.getStat for a known kind of stat. Emitted by the compiler, see Schema.
+def _getStatSum(state, target, stat):
+    if isinstance(target, list):
+        if state.rmap:
+            return [_getStatSum(state, i, stat) for i in target]
+        return _sumColumn(state, target, stat)
+    elif state.rmap:
+        return sum(_sumInheritance(state, i, stat) for i in _rmapUnits(state, target))
+    return _sumInheritance(state, target, stat)
+
+
+def _getStatList(state, target, stat):
+    if isinstance(target, list):
+        return [_getStatList(state, i, stat) for i in target]
+    elif state.rmap:
+        return [i for unit in _rmapUnits(state, target) for i in _listInheritance(state, unit, stat)]
+    return _listInheritance(state, target, stat)
+
+
+def _getStatString(state, target, stat):
+    if isinstance(target, list):
+        return [_getStatString(state, i, stat) for i in target]
+    elif state.rmap:
+        return _first(_stringInheritance(state, i, stat) for i in _rmapUnits(state, target))
+    return _stringInheritance(state, target, stat)
+
+
+Variables.env.update({
+    "_getStatSum": _getStatSum,
+    "_getStatList": _getStatList,
+    "_getStatString": _getStatString,
+})
 
 
 # ---------------------------------------------------
@@ -75,12 +159,36 @@ class Instance(dict):
         self.strings = {"name"} | options.get("strings", set())
         # rlist and rmap are flags that indicate objects entities should inherit from.
         self.rlist = ["group"] + options.get("rlist", [])
+        self.schema = Schema(frozenset(self.stats), frozenset(self.lists), frozenset(self.strings))
 
         # config
         self.name = options.get("name", 'Unknown')  # only effects what is printed when initialized
         self.logging = options.get("logging", True)  # Turns logging on and off
         self.revert = options.get("revert", 0)  # Determines how many steps should be saved in revert
+        self.keyframe = options.get("keyframe", 1)  # Ticks between full copies in the revert history, see udebs.history.
         self.immutable = options.get("immutable", False)  # Determines default setting for entities immutability.
+        self.fuse = options.get("fuse", False)  # Compile each move's requires and effects into one function.
+        self.cow = options.get("cow", False)  # Copies share entities and board rows until they change.
+        # Keywords available to this instance's scripts. Use Variables.copy() for private keywords.
+        self.registry = options.get("registry", Variables)
+        # Records time spent in each script and keyword, see udebs.profiler.
+        self.profiler = Profiler() if options.get("profile", False) else None
+        # Callables receiving structured events, see udebs.trace.
+        self.sinks = options.get("sinks", [])
+        self._fused = {}
+        # Names of entities this instance may change in place. None unless cow is set, see copy.
+        self._owned = None
+        # Storage of every running move, kept up to date when a shared entity is copied.
+        self._storages = []
+        # Undo records of unfinished undoable casts and the revert history. None when nothing is recorded.
+        self._journal = None
+        self._mark = 0  # Start of the current tick in the journal, see History.
+        self._open = 0  # Number of unfinished undoable casts.
+        self._zobrist = None  # Hash of all mutable entities, see getHash.
+        self._groups = {}  # Group name -> names of entities in it, see _groupIndex.
+        self._lineage = {}  # Entity name -> entities it inherits from, see _ancestors.
+        self._inherited = {}  # (entity name, stat) -> value inherited from immutable entities.
+        self._located = {}  # (entity name, location) -> immutable entity and its copy at location, see _locate.
 
         # time
         self.time = options.get("time", 0)  # In game counter
@@ -95,12 +203,11 @@ class Instance(dict):
         self.map = {}
         self.rmap = []
         for map_options in options.get("map", []):
-            self.map[map_options["name"]] = Board(**map_options)
+            board = ArrayBoard if map_options.get("store") == "array" else Board
+            self.map[map_options["name"]] = board(**map_options)
             if "rmap" in map_options:
                 self.rmap.append(map_options["name"])
 
-        self._rmap = _getStatRmap if self.rmap else _getStatInheritance
-
         # Entities
         self["empty"] = Entity(self, name="empty", immutable=True)
         for entity_options in options.get("entities", []):
@@ -128,7 +235,7 @@ class Instance(dict):
 
         # Initial logging
         if self.logging:
-            info(f"INITIALIZING {self.name}")
+            info("INITIALIZING %s", self.name)
 
         if init in self:
             self._controlMove(self["empty"], self["empty"], self[init])
@@ -139,7 +246,7 @@ class Instance(dict):
         # Set up Revert
         self.state = None
         if self.revert:
-            self.state = [self.copy()]
+            self._startHistory()
 
         super().__init__()
 
@@ -158,7 +265,8 @@ class Instance(dict):
             return False
 
         for k, v in self.__dict__.items():
-            if k not in ("state", "rand") and v != getattr(other, k):
+            if k not in ("state", "rand", "_fused", "profiler", "sinks", "_owned", "_storages", "_journal", "_mark", "_open",
+                         "_zobrist", "_groups", "_lineage", "_inherited", "_located") and v != getattr(other, k):
                 return False
 
         for k, v in self.items():
@@ -173,28 +281,86 @@ class Instance(dict):
     def __ne__(self, other) -> bool:
         return not self == other
 
+    def __setitem__(self, name: str, entity: Entity) -> None:
+        old = self.get(name)
+        dict.__setitem__(self, name, entity)
+        if "_groups" not in self.__dict__:
+            # Still being built by copy or pickle, which set up the caches themselves.
+            return
+
+        if not isinstance(entity, Entity) or not isinstance(old, (Entity, type(None))):
+            self._groups = {}
+            self._resetLineage()
+        elif old is None:
+            self._indexAdd(entity)
+        elif old is not entity:
+            if old.group != entity.group:
+                for group in (*old.group, *entity.group):
+                    self._groups.pop(group, None)
+            if self._lineage and (old.immutable or entity.immutable or any(
+                    getattr(old, lst) != getattr(entity, lst) for lst in self.rlist)):
+                self._resetLineage()
+
+    def __delitem__(self, name: str) -> None:
+        entity = self[name]
+        dict.__delitem__(self, name)
+        if isinstance(entity, Entity):
+            self._indexRemove(entity)
+        if name in self._lineage:
+            self._resetLineage()
+
     def __copy__(self) -> "Instance":
         return self.copy()
 
+    def __getstate__(self) -> dict:
+        # Compiled moves can not be pickled, they are compiled again when first cast.
+        state = dict(self.__dict__)
+        state["_fused"] = {}
+        # Sinks may hold open files and the profiler belongs to this process, like copy the result is not traced.
+        state["sinks"] = []
+        state["profiler"] = None
+        return state
+
     def copy(self, new=None) -> "Instance":
+        """
+        Returns a copy of this instance.
+
+        Note: If cow is set, the copy shares entities and board rows with this instance.
+        Whichever instance changes an entity first replaces it with a private copy, so
+        references to entities should be fetched again by name after a change.
+
+        Note: The copy starts without sinks, so tree searches and other hypothetical moves are not traced.
+        gameLoop passes the sinks on when it moves to the next state.
+        """
         if new is None:
             new = type(self)(is_copy=True)
 
         for k, v in self.__dict__.items():
-            if k not in {"delay", "map", "state", "next"}:
+            if k not in {"delay", "map", "state", "next", "_owned", "_storages", "_journal", "_mark", "_open", "_groups",
+                         "sinks"}:
                 setattr(new, k, v)
 
+        new.sinks = []
+        new._groups = {}
+        new._storages = []
+        new._journal = None
+        new._mark = 0
+        new._open = 0
+
         # Handle entities
-        for name, entity in self.items():
-            if entity.immutable:
-                new[name] = entity
-            else:
-                new[name] = entity.copy()
+        if self.cow:
+            dict.update(new, self)
+            # Neither instance owns its entities anymore.
+            self._owned = set()
+            new._owned = set()
+        else:
+            new._owned = None
+            dict.update(new, {name: entity if entity.immutable else entity.copy() for name, entity in self.items()})
 
         # Handle maps
         new.map = {}
         for name, map_ in self.map.items():
-            new.map[name] = map_.copy()
+            new.map[name] = map_.copy(cow=self.cow)
 
         # Handle delays
         new.delay = []
@@ -216,6 +382,291 @@ class Instance(dict):
 
         return new
 
+    def _own(self, entity: Entity) -> Entity:
+        """
+        Returns the version of entity this instance may change.
+
+        Shared entities are replaced with a private copy first, see copy.
+        """
+        if self._owned is None or entity.immutable:
+            return entity
+
+        name = entity.name
+        if name in self._owned:
+            return self[name]
+
+        current = self.get(name)
+        if current is None:
+            # Not one of ours, for example an anonymous quote.
+            return entity
+
+        new = current.copy()
+        # An identical copy, so the group index and inheritance cache stay valid.
+        dict.__setitem__(self, name, new)
+        self._owned.add(name)
+        if self._journal is not None:
+            self._journal.append(("item", name, current))
+
+        # Moves in progress must see the copy as well.
+        for storage in self._storages:
+            for k, v in storage.items():
+                if v is current:
+                    storage[k] = new
+
+        return new
+
+    # ---------------------------------------------------
+    #               Fused moves                        -
+    # ---------------------------------------------------
+    def _getFused(self, target: Entity):
+        """
+        Returns target's inherited requires and effects compiled into one function, see interpret.fuse.
+
+        Returns None if target's scripts depend on its location and must be evaluated one by one.
+        """
+        if target.loc and self.rmap:
+            return None
+
+        found = self._fused.get(target.name)
+        if found is not None and found[0] is target:
+            return found[1]
+
+        # An entity replaced from python, by undo or by a located copy is compiled again.
+        fused = fuse(self.getStat(target, "require"), self.getStat(target, "effect"), self.registry)
+        if fused is not None:
+            self._fused[target.name] = (target, fused)
+
+        return fused
+
+    def _resetFused(self, lst: str) -> None:
+        """Drops compiled moves and cached inheritance if lst can change what a move or entity inherits."""
+        if lst in self.rlist and self._lineage:
+            self._resetLineage()
+        if self._fused and (lst in self.rlist or lst in {"require", "effect"}):
+            # Copies share this dictionary until one of them changes.
+            if self._journal is not None:
+                self._journal.append(("attr", self, "_fused", self._fused))
+            self._fused = {}
+
+    # ---------------------------------------------------
+    #               Inheritance cache                  -
+    # ---------------------------------------------------
+    def _ancestors(self, target: Entity) -> tuple[tuple[str, ...], bool]:
+        """
+        Returns the names of every entity target inherits from through rlist, in the order getStat adds them,
+        and whether all of them are immutable. Values inherited from immutable entities never change,
+        so getStat caches them in _inherited.
+
+        Cached until a list in rlist changes or an entity is replaced, see _resetFused and __setitem__.
+
+        Note: Lists changed directly from python are not seen by entities already cached.
+        """
+        found = self._lineage.get(target.name)
+        if found is None:
+            names = []
+            for lst in self.rlist:
+                for unit in getattr(target, lst):
+                    names.append(unit)
+                    names.extend(self._ancestors(self[unit])[0])
+
+            found = self._lineage[target.name] = (tuple(names), all(self[unit].immutable for unit in names))
+        return found
+
+    def _resetLineage(self) -> None:
+        # Copies share these dictionaries until one of them changes.
+        self._lineage = {}
+        self._inherited = {}
+
+    # ---------------------------------------------------
+    #                   Group index                    -
+    # ---------------------------------------------------
+    def _groupIndex(self, group: str) -> dict:
+        """
+        Returns the names of every entity in group as dictionary keys, in the same order as the instance.
+
+        Each group is indexed the first time it is searched, then kept up to date by the control methods
+        and when entities are added, replaced or deleted.
+        """
+        names = self._groups.get(group)
+        if names is None:
+            names = self._groups[group] = {name: None for name, unit in self.items() if group in unit.group}
+        return names
+
+    def _indexAdd(self, entity: Entity) -> None:
+        """Adds an entity that was just added to the end of the instance to the group index."""
+        for group in entity.group:
+            names = self._groups.get(group)
+            if names is not None:
+                names[entity.name] = None
+
+    def _indexRemove(self, entity: Entity) -> None:
+        """Removes an entity from the group index."""
+        for group in entity.group:
+            names = self._groups.get(group)
+            if names is not None:
+                names.pop(entity.name, None)
+
+    # ---------------------------------------------------
+    #                   Undo journal                   -
+    # ---------------------------------------------------
+    def _startJournal(self) -> int:
+        """Starts recording changes. Returns a token for undo, always true since it is one past the start."""
+        if self._journal is None:
+            self._journal = []
+
+        token = len(self._journal) + 1
+        self._open += 1
+        self._journal.append((
+            "instance", self.time, self.cont, self.value, self.next,
+            self.state.copy() if self.state else self.state, self._mark, self._zobrist,
+            self.delay[:], [delay["ticks"] for delay in self.delay],
+            self.rand.getstate(),
+        ))
+        return token
+
+    def undo(self, token: int) -> None:
+        """
+        Reverts every change made since castMove(..., undoable=True) returned token.
+
+        Tokens must be undone in reverse order. Undoing a token also undoes every token given after it.
+
+        .. code-block:: python
+
+            token = main_map.castMove(caster, target, move, undoable=True)
+            main_map.undo(token)
+        """
+        journal = self._journal
+        if journal is None or not 0 < token <= len(journal):
+            raise ValueError(f"unknown undo token {token}")
+
+        start = token - 1
+        while len(journal) > start:
+            record = journal.pop()
+            kind = record[0]
+            if kind == "attr":
+                setattr(record[1], record[2], record[3])
+                if record[2] == "group":
+                    self._groups = {}
+                if record[2] in self.rlist:
+                    self._resetLineage()
+            elif kind == "list":
+                getattr(record[1], record[2])[:] = record[3]
+                if record[2] == "group":
+                    self._groups = {}
+                if record[2] in self.rlist:
+                    self._resetLineage()
+            elif kind == "board":
+                record[1][record[2]] = record[3]
+            elif kind == "item":
+                if record[2] is None:
+                    if record[1] in self:
+                        del self[record[1]]
+                else:
+                    self[record[1]] = record[2]
+                if self._owned is not None:
+                    # Never claim an entity back, a copy may share it by now.
+                    self._owned.discard(record[1])
+            else:
+                (_, self.time, self.cont, self.value, self.next, self.state, self._mark, self._zobrist,
+                 self.delay, ticks, rand) = record
+                for delay, tick in zip(self.delay, ticks):
+                    delay["ticks"] = tick
+                self.rand.setstate(rand)
+                self._open -= 1
+
+        if not journal and not self.state:
+            self._journal = None
+
+    def _startHistory(self) -> None:
+        """Starts a new revert history, see udebs.history."""
+        self.state = History(self.revert, self.keyframe)
+        if self._journal is None and self.keyframe > 1:
+            self._journal = []
+        self._mark = len(self._journal) if self._journal is not None else 0
+        self.state.record(self)
+
+    # ---------------------------------------------------
+    #                   Hashing                        -
+    # ---------------------------------------------------
+    @staticmethod
+    def _hashTerm(entity: Entity, attr: str) -> int:
+        """Contribution of one attribute of a mutable entity to getHash."""
+        if attr in entity.lists:
+            return hash_key(entity.name, attr, tuple(getattr(entity, attr)))
+        elif attr in entity.other and attr not in ("name", "immutable", "loc"):
+            return hash_key(entity.name, attr, getattr(entity, attr))
+        return 0
+
+    def _entityHash(self, entity: Entity) -> int:
+        value = 0
+        if not entity.immutable:
+            for attr in entity.lists:
+                value ^= self._hashTerm(entity, attr)
+            for attr in entity.other:
+                value ^= self._hashTerm(entity, attr)
+        return value
+
+    def getHash(self) -> int:
+        """
+        Returns a 64 bit hash of the game state: mutable entities, maps, time, value and pending delays.
+
+        The first call scans the whole game. After that the control methods keep the hash up to date,
+        so later calls are O(1) in the size of the game.
+
+        Note: Entities changed directly from python instead of through the control methods are not seen.
+
+        .. code-block:: python
+
+            main_map.getHash()
+        """
+        if self._zobrist is None:
+            value = 0
+            for entity in self.values():
+                value ^= self._entityHash(entity)
+            self._zobrist = value
+
+        value = self._zobrist ^ hash_key("time", self.time) ^ hash_key("value", self.value)
+        for map_ in self.map.values():
+            value ^= map_.getHash()
+
+        if self.delay:
+            value ^= hash_key("delay", tuple(
+                (str(delay["script"]), delay["ticks"], tuple((k, str(v)) for k, v in delay["env"]["storage"].items()))
+                for delay in self.delay
+            ))
+
+        return value
+
+    # ---------------------------------------------------
+    #                   Tracing                        -
+    # ---------------------------------------------------
+    def _emit(self, kind: str, *fields) -> None:
+        """Passes an event to every sink. Callers check self.sinks first so disabled tracing costs nothing."""
+        event = (kind, self.time, *fields)
+        for sink in self.sinks:
+            sink(event)
+
+    def _bulk(self, targets: Entity | list[Entity]) -> Optional[list[Entity]]:
+        """
+        Returns the mutable entities in targets if changing them needs no work per entity beyond the undo journal.
+
+        Lets CHANGE and REPLACE on a long list like ALL.cells set every value in one pass.
+        Returns None if targets is not a list or the change must be hashed, traced, logged or copied on write.
+        """
+        if isinstance(targets, list) and self._owned is None and self._zobrist is None and not (
+                self.sinks or (self.logging and logger.isEnabledFor(logging.INFO))):
+            return [target for target in targets if not target.immutable]
+        return None
+
+    @staticmethod
+    def _traceName(value: Any) -> Any:
+        """Entities are recorded by name, or by location if they are immutable and on a map."""
+        if isinstance(value, Entity):
+            if value.immutable and value.loc:
+                return value.loc
+            return value.name
+        return value
+
     # ---------------------------------------------------
     #               Selector Function                  -
     # ---------------------------------------------------
@@ -246,17 +697,21 @@ class Instance(dict):
                         bracket -= 1
 
                     if not bracket and char == ",":
-                        scripts.append(Script("".join(buf), skip_interpret=skip_interpret))
+                        scripts.append(Script("".join(buf), skip_interpret=skip_interpret, registry=self.registry,
+                                              schema=self.schema))
                         buf = []
                         continue
 
                     buf.append(char)
 
-                scripts.append(Script("".join(buf), skip_interpret=skip_interpret))
+                scripts.append(Script("".join(buf), skip_interpret=skip_interpret, registry=self.registry,
+                                      schema=self.schema))
 
             else:
-                scripts.append(Script(target, skip_interpret=skip_interpret))
+                scripts.append(Script(target, skip_interpret=skip_interpret, registry=self.registry, schema=self.schema))
 
+            if self._journal is not None:
+                self._journal.append(("item", target, None))
             self[target] = Entity(self, require=scripts, name=target, immutable=True)
 
         return self[target]
@@ -265,8 +720,8 @@ class Instance(dict):
     def controlConst(self, storage: dict, code: str, *args) -> Any:
         key = (code, *args)
         if key not in self.constants:
-            code = Script(code, skip_interpret=True)
-            self.constants[key] = eval(code.code, Variables.env, {"storage": storage, "self": self})
+            code = Script(code, skip_interpret=True, registry=self.registry)
+            self.constants[key] = eval(code.code, self.registry.env, {"storage": storage, "self": self})
 
         return self.constants[key]
 
@@ -310,10 +765,24 @@ class Instance(dict):
         if not unit.loc:
             if len(target) < 3:
                 target = (*target, "map")
+            if unit.immutable:
+                return self._locate(unit, target)
             unit = unit.copy(loc=target)
 
         return unit
 
+    def _locate(self, unit: Entity, loc: tuple) -> Entity:
+        """
+        Returns a copy of an immutable entity placed at loc.
+
+        Immutable entities never change, so one copy per entity and cell is kept and shared by every copy of the instance.
+        """
+        found = self._located.get((unit.name, loc))
+        if found is None or found[0] is not unit:
+            # An entity replaced from python or by undo gets a new copy.
+            found = self._located[unit.name, loc] = (unit, unit.copy(loc=loc))
+        return found[1]
+
     @register({"args": ["self", "-$1"], "default": {"-$1": "$caster"}}, name="MAP")
     def getMap(self, target: str | tuple | Board | Entity = "map") -> Board:
         """
@@ -346,7 +815,16 @@ class Instance(dict):
         new = []
         for delay in self.delay:
             if delay['ticks'] <= 0:
-                delay['script'](delay['env'])
+                if self.sinks:
+                    self._emit(trace.DELAY, str(delay['script']))
+                if self._owned is None:
+                    delay['script'](delay['env'])
+                else:
+                    self._storages.append(delay['env']['storage'])
+                    try:
+                        delay['script'](delay['env'])
+                    finally:
+                        self._storages.pop()
             else:
                 new.append(delay)
 
@@ -373,7 +851,7 @@ class Instance(dict):
             # Increment time
             self.time += 1
             if self.logging:
-                info(f'Env time is now {self.time}')
+                info('Env time is now %s', self.time)
 
             # Process tick script
             if script in self:
@@ -390,11 +868,9 @@ class Instance(dict):
 
             # Append new version to state.
             if self.state:
-                test = self.copy()
-                self.state.append(test)
-                if len(self.state) > self.revert:
-                    self.state = self.state[-self.revert:]
-                    assert self.state[-1] is test
+                self.state.record(self)
+            elif self._journal is not None and not self._open:
+                self._journal = None
 
         return self.cont
 
@@ -409,17 +885,7 @@ class Instance(dict):
             main_map.getRevert(5)
         """
         if self.state:
-            new_states = self.state.copy()
-            new = self
-            for i in range(time + 1):
-                try:
-                    new = new_states.pop()
-                except IndexError:
-                    return None
-
-            new.state = new_states
-            new.state.append(new.copy())
-            return new
+            return self.state.get(time)
 
     @register(["self", "$1", "$2", "storage"], name="DELAY")
     def controlDelay(self, callback: Entity, time: str, storage: dict) -> bool:
@@ -443,7 +909,7 @@ class Instance(dict):
 
         self.delay.append(new_delay)
         if self.logging:
-            info(f"effect added to delay for {time}")
+            info("effect added to delay for %s", time)
         return True
 
     # ---------------------------------------------------
@@ -471,18 +937,18 @@ class Instance(dict):
             <i>target [$caster] GROUP</i>
             <i>target [$caster] NAME</i>
         """
-        if isinstance(target, list):
-            return [self.getStat(i, stat, inherit) for i in target]
-        elif not inherit:
+        if not inherit:
+            if isinstance(target, list):
+                return [self.getStat(i, stat, inherit) for i in target]
             return getattr(target, stat)
         elif stat in self.stats:
-            return sum(self._rmap(self, target, stat))
+            return _getStatSum(self, target, stat)
         elif stat in self.lists:
-            return [i for j in self._rmap(self, target, stat) for i in j]
+            return _getStatList(self, target, stat)
         elif stat in self.strings:
-            for i in self._rmap(self, target, stat):
-                if i is not None:
-                    return i
+            return _getStatString(self, target, stat)
+        elif isinstance(target, list):
+            return [self.getStat(i, stat, inherit) for i in target]
         else:
             raise UndefinedSelectorError(stat, "stat")
 
@@ -495,6 +961,9 @@ class Instance(dict):
 
             <i>ALL group</i>
         """
+        if len(args) == 1:
+            return [self[name] for name in self._groupIndex(args[0])]
+
         groups = set(args)
 
         found = []
@@ -537,9 +1006,9 @@ class Instance(dict):
             <i>target [$caster] lst LISTGROUP group</i>
             <i>target [$caster] CLASS group</i>
         """
-        start = self.getStat(target, lst)
-        for item in start:
-            if group in self[item].group:
+        names = self._groupIndex(group)
+        for item in self.getStat(target, lst):
+            if item in names:
                 return item
         return False
 
@@ -552,15 +1021,21 @@ class Instance(dict):
 
             <i>SEARCH arg1 arg2 ...</i>
         """
-        found = self.getAll(args[0], "group")
-        for arg in args[1:]:
-            new = []
-            for i in found:
-                if arg in i.group:
-                    new.append(i)
-            found = new
+        if self._groupIndex("group"):
+            found = self.getAll(args[0], "group")
+            for arg in args[1:]:
+                found = [i for i in found if arg in i.group]
+            return found
 
-        return found
+        # Every group is in instance order, so walking the smallest one keeps that order.
+        groups = sorted((self._groupIndex(arg) for arg in args), key=len)
+        if len(groups) == 1:
+            return [self[name] for name in groups[0]]
+
+        common = groups[0].keys() & groups[1].keys()
+        for names in groups[2:]:
+            common &= names.keys()
+        return [self[name] for name in groups[0] if name in common]
 
     # ---------------------------------------------------
     #                 Call wrappers                    -
@@ -594,19 +1069,33 @@ class Instance(dict):
                     target_name = target.loc
 
                 if target == caster == self["empty"]:
-                    info(f"init {move}")
+                    info("init %s", move)
                 elif target == self["empty"]:
-                    info(f"{caster_name} uses {move}")
+                    info("%s uses %s", caster_name, move)
                 else:
-                    info(f"{caster_name} uses {move} on {target_name}")
+                    info("%s uses %s on %s", caster_name, move, target_name)
 
             # Cast the move
-            env["storage"] = {"caster": caster, "target": target, "move": move}
-            test = move(env, force=force)
+            if self._owned is None:
+                env["storage"] = {"caster": caster, "target": target, "move": move}
+                test = move(env, force=force)
+            else:
+                # Earlier casts may have replaced shared entities.
+                caster, target, move = (self[i.name] if i.name in self._owned else i for i in (caster, target, move))
+                env["storage"] = {"caster": caster, "target": target, "move": move}
+                self._storages.append(env["storage"])
+                try:
+                    test = move(env, force=force)
+                finally:
+                    self._storages.pop()
             if test is None:
                 value = True
             elif self.logging:
-                info(f"failed because {test}")
+                info("failed because %s", test)
+
+            if self.sinks:
+                self._emit(trace.CAST, self._traceName(caster), self._traceName(target), move.name,
+                           None if test is None else str(test))
 
         return value
 
@@ -629,7 +1118,7 @@ class Instance(dict):
             if callback(env) is not None:
                 success = False
                 if self.logging:
-                    info(f"Repeat failed at {i}th interval")
+                    info("Repeat failed at %sth interval", i)
 
                 if force:
                     for j in range(timeout - 1):
@@ -691,7 +1180,7 @@ class Instance(dict):
             result = condition(env)
             if result is not None:
                 if self.logging:
-                    info(f"And failed at: {result}")
+                    info("And failed at: %s", result)
                 return False
 
         return True
@@ -751,9 +1240,13 @@ class Instance(dict):
         if new.castMove(caster, target, move, **kwargs):
             return new
 
-    def castMove(self, caster: str, target: str, move: str, force: bool = False, time: Optional[int] = None):
+    def castMove(self, caster: str, target: str, move: str, force: bool = False, time: Optional[int] = None,
+                 undoable: bool = False):
         """Cast an action including both a caster and a target.
 
+        If undoable is True, every change the move makes is recorded and an undo token is returned
+        instead of True, see undo. Failed moves return None and leave no changes behind.
+
         .. code-block:: xml
 
             <i>caster [$caster] CAST target move</i>
@@ -762,12 +1255,28 @@ class Instance(dict):
         target = self.getEntity(target)
         move = self.getEntity(move)
 
-        value = self._controlMove(caster, target, move, force=force)
+        if not undoable:
+            value = self._controlMove(caster, target, move, force=force)
+            if value:
+                self._checkDelay()
+                self.controlTime(self.increment if time is None else time)
+            return value
+
+        token = self._startJournal()
+        try:
+            value = self._controlMove(caster, target, move, force=force)
+            if value:
+                self._checkDelay()
+                self.controlTime(self.increment if time is None else time)
+        except BaseException:
+            self.undo(token)
+            raise
+
         if value:
-            self._checkDelay()
-            self.controlTime(self.increment if time is None else time)
+            return token
 
-        return value
+        self.undo(token)
+        return None
 
     def castLambda(self, string: str) -> bool | str:
         """
@@ -791,7 +1300,7 @@ class Instance(dict):
 
             main_map.castSingle("caster CAST target move")
         """
-        code = Script(string)
+        code = Script(string, registry=self.registry)
         return eval(code.code, {"storage": {}, "self": self})
 
     # ---------------------------------------------------
@@ -809,13 +1318,27 @@ class Instance(dict):
         if not isinstance(entries, list):
             entries = [entries]
 
+        self._resetFused(lst)
         changed = False
         for target, entry in product(targets, entries):
             if not target.immutable:
+                if self._owned is not None:
+                    target = self._own(target)
+                if self._journal is not None:
+                    self._journal.append(("list", target, lst, getattr(target, lst)[:]))
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, lst)
                 getattr(target, lst).append(entry)
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, lst)
+                if lst == "group":
+                    # Reindexed when next searched, so the group stays in instance order.
+                    self._groups.pop(entry, None)
                 changed = True
                 if self.logging:
-                    info(f"{entry} added to {target} {lst}")
+                    info("%s added to %s %s", entry, target, lst)
+                if self.sinks:
+                    self._emit(trace.LIST, target.name, lst, "add", self._traceName(entry))
 
         return changed
 
@@ -831,15 +1354,29 @@ class Instance(dict):
         if not isinstance(entries, list):
             entries = [entries]
 
+        self._resetFused(lst)
         changed = False
         for target, entry in product(targets, entries):
             if not target.immutable:
                 value = getattr(target, lst)
                 if entry in value:
+                    if self._owned is not None:
+                        target = self._own(target)
+                        value = getattr(target, lst)
+                    if self._journal is not None:
+                        self._journal.append(("list", target, lst, value[:]))
+                    if self._zobrist is not None:
+                        self._zobrist ^= self._hashTerm(target, lst)
                     changed = True
                     value.remove(entry)
+                    if self._zobrist is not None:
+                        self._zobrist ^= self._hashTerm(target, lst)
+                    if lst == "group" and entry not in value and entry in self._groups:
+                        self._groups[entry].pop(target.name, None)
                     if self.logging:
-                        info(f"{entry} removed from {target} {lst}")
+                        info("%s removed from %s %s", entry, target, lst)
+                    if self.sinks:
+                        self._emit(trace.LIST, target.name, lst, "remove", self._traceName(entry))
 
         return changed
 
@@ -852,13 +1389,24 @@ class Instance(dict):
 
             <i>target [$caster] CLEAR lst</i>
         """
+        self._resetFused(lst)
         changed = False
         for target in targets:
             if not target.immutable:
+                if self._owned is not None:
+                    target = self._own(target)
+                if self._journal is not None:
+                    self._journal.append(("list", target, lst, getattr(target, lst)[:]))
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, lst)
+                if lst == "group":
+                    self._indexRemove(target)
                 getattr(target, lst).clear()
                 changed = True
                 if self.logging:
-                    info(f"{target} {lst} has been cleared")
+                    info("%s %s has been cleared", target, lst)
+                if self.sinks:
+                    self._emit(trace.LIST, target.name, lst, "clear", None)
 
         return changed
 
@@ -875,13 +1423,24 @@ class Instance(dict):
             self.rand.shuffle(lst)
             return lst
 
+        self._resetFused(lst)
         changed = False
         for target in targets:
             if not target.immutable:
+                if self._owned is not None:
+                    target = self._own(target)
+                if self._journal is not None:
+                    self._journal.append(("list", target, lst, getattr(target, lst)[:]))
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, lst)
                 self.rand.shuffle(getattr(target, lst))
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, lst)
                 changed = True
                 if self.logging:
-                    info(f"{target} {lst} has been shuffled")
+                    info("%s %s has been shuffled", target, lst)
+                if self.sinks:
+                    self._emit(trace.LIST, target.name, lst, "shuffle", None)
 
         return changed
 
@@ -900,14 +1459,33 @@ class Instance(dict):
             <i>target stat -= increment</i>
             <i>target [$caster] stat CHANGE increment</i>
         """
-        changed = False
         total = int(increment * multi)
+        bulk = self._bulk(targets)
+        if bulk is not None:
+            if self._journal is not None:
+                self._journal.extend([("attr", target, stat, getattr(target, stat)) for target in bulk])
+            for target in bulk:
+                setattr(target, stat, getattr(target, stat) + total)
+            return bool(bulk)
+
+        changed = False
         for target in targets:
             if not target.immutable:
-                setattr(target, stat, getattr(target, stat) + total)
+                if self._owned is not None:
+                    target = self._own(target)
+                old = getattr(target, stat)
+                if self._journal is not None:
+                    self._journal.append(("attr", target, stat, old))
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, stat)
+                setattr(target, stat, old + total)
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, stat)
                 changed = True
-                if self.logging:
-                    info(f"{target} {stat} changed by {total} is now {self.getStat(target, stat)}")
+                if self.sinks:
+                    self._emit(trace.STAT, target.name, stat, old, old + total)
+                if self.logging and logger.isEnabledFor(logging.INFO):
+                    info("%s %s changed by %s is now %s", target, stat, total, self.getStat(target, stat))
 
         return changed
 
@@ -922,13 +1500,41 @@ class Instance(dict):
 
             <i>caster [$caster] stat REPLACE value</i>
         """
+        self._resetFused(stat)
+        if stat == "group" and self._groups:
+            # Groups the targets leave or join are indexed again on the next search.
+            dropped = set(value) if isinstance(value, (list, tuple)) else {value}
+            for target in targets:
+                dropped.update(target.group)
+            for group in dropped:
+                self._groups.pop(group, None)
+
+        bulk = self._bulk(targets)
+        if bulk is not None:
+            if self._journal is not None:
+                self._journal.extend([("attr", target, stat, getattr(target, stat)) for target in bulk])
+            for target in bulk:
+                setattr(target, stat, value)
+            return bool(bulk)
+
         changed = False
         for target in targets:
             if not target.immutable:
+                if self._owned is not None:
+                    target = self._own(target)
+                if self.sinks:
+                    self._emit(trace.STAT, target.name, stat, self._traceName(getattr(target, stat)),
+                               self._traceName(value))
+                if self._journal is not None:
+                    self._journal.append(("attr", target, stat, getattr(target, stat)))
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, stat)
                 setattr(target, stat, value)
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, stat)
                 changed = True
                 if self.logging:
-                    info(f"{target} {stat} changed to {value}")
+                    info("%s %s changed to %s", target, stat, value)
 
         return changed
 
@@ -950,12 +1556,22 @@ class Instance(dict):
 
         for position in positions:
             if not target.immutable:
+                if self._owned is not None:
+                    target = self._own(target)
+                    self._owned.add(f"{target.name}{target.increment + 1}")
+                if self._journal is not None:
+                    self._journal.append(("attr", target, "increment", target.increment))
+                    self._journal.append(("item", f"{target.name}{target.increment + 1}", None))
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, "increment")
                 target.increment += 1
                 name = f"{target.name}{target.increment}"
                 new = target.copy(name=name, increment=0)
                 self[name] = new
+                if self._zobrist is not None:
+                    self._zobrist ^= self._hashTerm(target, "increment") ^ self._entityHash(new)
                 if self.logging:
-                    info(f"{name} has been recruited")
+                    info("%s has been recruited", name)
             self.controlTravel(new, position)
 
         return new
@@ -970,11 +1586,24 @@ class Instance(dict):
             <i>target DELETE</i>
         """
         if not target.immutable:
+            if self._owned and target.name in self._owned:
+                target = self[target.name]
+            if self._journal is not None:
+                self._journal.append(("item", target.name, target))
+                self._journal.append(("attr", self, "_fused", self._fused))
+                if target.loc:
+                    self._journal.append(("board", self.map[target.loc[2]], target.loc, self.map[target.loc[2]][target.loc]))
+            if target.name in self._fused:
+                self._fused = {}
+            if self._zobrist is not None:
+                self._zobrist ^= self._entityHash(target)
             del self[target.name]
+            if self._owned is not None:
+                self._owned.discard(target.name)
             if target.loc:
                 del self.map[target.loc[2]][target.loc]
             if self.logging:
-                info(f"{target} has been deleted")
+                info("%s has been deleted", target)
             return True
         return False
 
@@ -1034,21 +1663,75 @@ class Instance(dict):
     # ---------------------------------------------------
     #                 Board get wrappers               -
     # ---------------------------------------------------
-    @register({"args": ["self", "$2", "$3", "$1"], "default": {"$2": "$caster", "$3": "$target"}}, name="PATH")
-    def getPath(self, caster: tuple | Entity, target: tuple | Entity, callback: Entity) -> list[tuple]:
+    def searchFilter(self, callback: Entity, caster: Entity):
+        """
+        Returns a function testing if callback allows caster's board search into a loc, see Board.get_adjacent.
+
+        callback's requires are looked up once per search instead of once per loc and every loc is
+        tested at most once. If the requires only read entity data (see interpret.entity_only),
+        the result for an immutable entity is reused for every loc holding it.
+        """
+        requires = None
+        if self.profiler is None and not self.fuse:
+            requires = self.getStat(callback, "require")
+
+        by_name = not self.rmap and entity_only(self.getStat(callback, "require"), self.registry)
+        env = self.registry.env
+        found = {}
+        names = {}
+
+        def allows(loc):
+            value = found.get(loc)
+            if value is None and by_name:
+                value = names.get(self.map[loc[2]][loc])
+            if value is not None:
+                return value
+
+            target = self.getEntity(loc)
+            local = {"storage": {"caster": caster, "target": target, "move": callback}, "self": self}
+            if requires is None:
+                value = callback.test(local) is None
+            else:
+                value = True
+                for require in requires:
+                    try:
+                        passed = eval(require.code, env, local)
+                    except RecursionError:
+                        raise
+                    except Exception:
+                        raise UdebsExecutionError(require)
+
+                    if not passed:
+                        value = False
+                        break
+
+            if by_name and target.immutable:
+                names[target.name] = value
+            else:
+                found[loc] = value
+            return value
+
+        return allows
+
+    @register({"args": ["self", "$2", "$3", "$1"], "default": {"$2": "$caster", "$3": "$target", "-$1": None},
+               "kwargs": {"method": "-$1"}}, name="PATH")
+    def getPath(self, caster: tuple | Entity, target: tuple | Entity, callback: Entity,
+                method: Optional[str] = None) -> list[tuple]:
         """
         Finds a path between caster and target using callback as filter for valid space.
 
+        method selects the search, "bfs" (default), "astar" or "bidirectional". All of them find a shortest path.
+
         .. code-block:: xml
 
-            <i>PATH callback caster [$caster] target [$target]</i>
+            <i>method [bfs] PATH callback caster [$caster] target [$target]</i>
         """
         caster = self.getLocObject(caster)
         if caster:
             target = self.getLocObject(target)
             map_ = self.map[caster[2]]
             if map_.test_loc(target):
-                return map_.get_path(caster, target, callback=callback, state=self)
+                return map_.get_path(caster, target, method, callback=callback, state=self)
 
         return []
 
@@ -1112,6 +1795,54 @@ class Instance(dict):
 
         return []
 
+    def _stepCost(self, stat: str):
+        """Returns a function giving the cost of moving into a loc, the stat of the entity there."""
+        return lambda loc: self.getStat(self.getEntity(loc), stat)
+
+    @register({"args": ["self", "$2", "$3", "$1", "$4"], "default": {"$2": "$caster", "$3": "$target", "$4": None}},
+              name="WPATH")
+    def getWeightedPath(self, caster: tuple | Entity, target: tuple | Entity, stat: str,
+                        callback: Optional[Entity] = None) -> list[tuple]:
+        """
+        Finds the cheapest path between caster and target.
+        Moving into a space costs stat of the entity in that space, callback optionally filters valid space.
+
+        .. code-block:: xml
+
+            <i>WPATH stat caster [$caster] target [$target] callback [None]</i>
+        """
+        caster = self.getLocObject(caster)
+        if caster:
+            target = self.getLocObject(target)
+            map_ = self.map[caster[2]]
+            if map_.test_loc(target):
+                return map_.get_weighted_path(caster, target, self._stepCost(stat), callback=callback, state=self)
+
+        return []
+
+    @register({"args": ["self", "$1", "$2", "$3", "$4", "$5"], "default": {"$3": None, "$4": None, "$5": True}},
+              name="WFILL")
+    def getWeightedFill(self, center: tuple | Entity, stat: str, limit: Optional[Number] = None,
+                        callback: Optional[Entity] = None, include_center: bool = True) -> list[tuple]:
+        """
+        Gets all squares reachable from center for at most limit total cost.
+        Moving into a space costs stat of the entity in that space, callback optionally filters valid space.
+
+        .. code-block:: xml
+
+            <i>WFILL center stat limit [null] callback [null] include_center [true]</i>
+        """
+        if limit is None:
+            limit = float("inf")
+
+        center = self.getLocObject(center)
+        if center:
+            map_ = self.map[center[2]]
+            return sorted(map_.get_weighted_fill(center, self._stepCost(stat), limit, include_center,
+                                                 callback=callback, state=self))
+
+        return []
+
     def printMap(self, board: str = "map"):
         """Print a map."""
         self.map[board].show()
@@ -1135,9 +1866,16 @@ class Instance(dict):
         if len(targets) > 1 and not caster.immutable:
             raise Exception("Non immutable entities cannot be moved to multiple locations.")
 
+        if self._owned is not None:
+            caster = self._own(caster)
+
         for target in targets:
+            old = caster.loc
             # First remove caster from its current location
             if not caster.immutable and caster.loc:
+                if self._journal is not None:
+                    map_ = self.map[caster.loc[2]]
+                    self._journal.append(("board", map_, caster.loc, map_[caster.loc]))
                 del self.map[caster.loc[2]][caster.loc]
 
             # Then move caster to target location.
@@ -1147,17 +1885,28 @@ class Instance(dict):
                 unit_name = map_[target]
                 unit_self = self[unit_name]
 
+                if self._journal is not None:
+                    self._journal.append(("board", map_, target, unit_name))
                 map_[target] = caster.name
                 if not unit_self.immutable:
+                    if self._owned is not None:
+                        unit_self = self._own(unit_self)
+                    if self._journal is not None:
+                        self._journal.append(("attr", unit_self, "loc", unit_self.loc))
                     unit_self.loc = None
 
                 if self.logging:
-                    info(f"{caster} has moved to {target}")
+                    info("%s has moved to %s", caster, target)
 
             # Update the entity itself.
             if not caster.immutable:
+                if self._journal is not None:
+                    self._journal.append(("attr", caster, "loc", caster.loc))
                 caster.loc = target
 
+            if self.sinks:
+                self._emit(trace.MOVE, caster.name, old, target)
+
     # ---------------------------------------------------
     #                 Game Loop Helpers                -
     # ---------------------------------------------------
@@ -1181,6 +1930,8 @@ class Instance(dict):
                     current.state = None
 
                 current.next.increment = current.increment
+                if not current.next.sinks:
+                    current.next.sinks = current.sinks
                 current = current.next
                 current.next = None
                 continue
@@ -1188,7 +1939,7 @@ class Instance(dict):
             current.controlTime(current.increment, script=script)
 
         if current.logging:
-            info(f"EXITING {current.name}\n")
+            info("EXITING %s\n", current.name)
 
     @register({"args": ["self", "$1"], "default": {"$1": 1}}, name="EXIT")
     def exit(self, value: int = 1) -> None:
@@ -1199,7 +1950,7 @@ class Instance(dict):
             <i>EXIT</i>
         """
         if self.logging:
-            info(f"Exit requested with value of: {value}")
+            info("Exit requested with value of: %s", value)
         self.cont = False
         self.value = value
 
@@ -1219,7 +1970,7 @@ class Instance(dict):
             self.rand.seed(self.seed)
 
         if self.logging:
-            info(f"Env time is now {self.time}")
+            info("Env time is now %s", self.time)
 
         if script in self:
             if self._controlMove(self["empty"], self["empty"], self[script]):
@@ -1229,6 +1980,6 @@ class Instance(dict):
             info("")
 
         if self.revert:
-            self.state = [self.copy()]
+            self._startHistory()
 
         return self
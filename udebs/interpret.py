@@ -1,15 +1,83 @@
+import ast
+import importlib
 import inspect
+import itertools
+import re
+from collections import OrderedDict, namedtuple
+from types import ModuleType
 
 from udebs import errors
 import operator
 
 
-class Variables:
-    modules = {}
-    env = {
-        "__builtins__": {"abs": abs, "min": min, "max": max, "len": len, "getattr": getattr},
-        "operator": operator,
-    }
+# Every registry change draws a new number, so a version identifies one registry in one state.
+_versions = itertools.count()
+
+
+class _Tracked(dict):
+    """Dictionary that gives its registry a new version whenever it changes."""
+
+    def __init__(self, registry, *args):
+        super().__init__(*args)
+        self.registry = registry
+
+    def _changed(self):
+        self.registry.version = next(_versions)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other):
+        super().update(other)
+        self._changed()
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._changed()
+        return value
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def popitem(self):
+        value = super().popitem()
+        self._changed()
+        return value
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+def _loadRegistry(modules, env, imports):
+    """Unpickles a registry, see Registry.__reduce__."""
+    for k, v in imports.items():
+        env[k] = importlib.import_module(v)
+    return Registry(modules, env)
+
+
+class Registry:
+    """Keywords and python globals used to interpret and run scripts.
+
+    modules - Call pattern of every keyword, see register.
+    env - Globals available to compiled scripts.
+    version - Changes whenever modules or env change. Anything compiled against a registry is keyed on it.
+
+    Variables is the default registry shared by every Instance. Registry.copy creates an
+    isolated registry so an Instance can have its own keywords, see Instance(registry=...).
+    """
     default = {
         "f": "",
         "args": [],
@@ -17,14 +85,61 @@ class Variables:
         "all": False,
         "default": {},
         "string": [],
+        "pure": False,
+        "lazy": [],
     }
 
+    def __init__(self, modules=None, env=None):
+        if env is None:
+            env = {
+                "__builtins__": {"abs": abs, "min": min, "max": max, "len": len, "getattr": getattr},
+                "operator": operator,
+            }
+
+        self.version = next(_versions)
+        self.modules = _Tracked(self, {} if modules is None else modules)
+        self.env = _Tracked(self, env)
+        self._pure = (None, {})
+
+    def __repr__(self):
+        return f"<Registry {len(self.modules)} keywords, version {self.version}>"
+
+    def __reduce__(self):
+        if self is Variables:
+            return "Variables"
+        # Modules can not be pickled, they are imported again by name.
+        env = {k: v for k, v in self.env.items() if not isinstance(v, ModuleType)}
+        imports = {k: v.__name__ for k, v in self.env.items() if isinstance(v, ModuleType)}
+        return _loadRegistry, (dict(self.modules), env, imports)
+
+    def copy(self) -> "Registry":
+        """Returns an independent registry starting with every keyword of this one."""
+        return Registry(self.modules, self.env)
+
+    def register(self, function, *args, name=None):
+        """Same as udebs.register but only adds the keyword to this registry."""
+        return register(function, *args, name=name, registry=self)
+
+    def pure(self) -> dict:
+        """Maps the python name of every pure keyword to its function."""
+        version, found = self._pure
+        if version != self.version:
+            found = _pure_functions(self)
+            self._pure = (self.version, found)
+        return found
+
+
+Variables = Registry()
+
 
 # ---------------------------------------------------
 #            Interpreter Functions                 -
 # ---------------------------------------------------
-def formatS(string):
+def formatS(string, registry=None):
     """Converts a string into its python representation."""
+    if registry is None:
+        registry = Variables
+
     string = str(string)
     if string == "self":
         return string
@@ -44,19 +159,27 @@ def formatS(string):
     # String has already been handled by call
     elif string[-1] == ")":
         return string
-    elif string in Variables.env:
+    elif string in registry.env:
         return string
     # In case prefix notation used in keyword defaults.
-    elif string[0] in Variables.modules:
-        return interpret(string)
+    elif string[0] in registry.modules:
+        return interpret(string, registry=registry)
     else:
         return "'" + string + "'"
 
 
-def call(args, root=False):
+def thunk(string):
+    """Wraps a python function string in a lambda so it is only evaluated when called."""
+    return f"(lambda self=self,storage=storage:{string})"
+
+
+def call(args, root=False, registry=None):
     """Converts callList into functionString."""
+    if registry is None:
+        registry = Variables
+
     # Find keyword
-    keywords = [i for i in args if i in Variables.modules]
+    keywords = [i for i in args if i in registry.modules]
 
     # Too many keywords is a syntax error.
     if len(keywords) > 1:
@@ -64,7 +187,7 @@ def call(args, root=False):
 
     # No keywords create a tuple object.
     elif len(keywords) == 0 and not root:
-        return "(" + ",".join(formatS(i) for i in args) + ")"
+        return "(" + ",".join(formatS(i, registry) for i in args) + ")"
 
     elif len(keywords) == 0 and root:
         raise errors.UdebsSyntaxError(f"No keywords in root objected '{args}'")
@@ -73,8 +196,8 @@ def call(args, root=False):
 
     # Get and fix data for this keyword.
     data = {}
-    data.update(Variables.default)
-    data.update(Variables.modules[keyword])
+    data.update(registry.default)
+    data.update(registry.modules[keyword])
 
     # Create dict of values
     current = args.index(keyword)
@@ -100,21 +223,24 @@ def call(args, root=False):
             del nodes[value]
         else:
             new_value = value
-        kwargs[key] = formatS(new_value)
+        kwargs[key] = formatS(new_value, registry)
 
+    lazy = data["lazy"]
     arguments = []
     # Insert positional arguments
     for key in data["args"]:
         if key in nodes:
-            arguments.append(formatS(nodes[key]))
+            value = formatS(nodes[key], registry)
             del nodes[key]
         else:
-            arguments.append(formatS(key))
+            value = formatS(key, registry)
+        arguments.append(thunk(value) if lazy is True or key in lazy else value)
 
     # Insert ... arguments.
     if data["all"]:
         for key in sorted(nodes.keys(), key=lambda x: int(x.replace("$", ""))):
-            arguments.append(formatS(nodes[key]))
+            value = formatS(nodes[key], registry)
+            arguments.append(thunk(value) if lazy is True or key in lazy else value)
             del nodes[key]
 
     if len(nodes) > 0:
@@ -127,108 +253,526 @@ def call(args, root=False):
     return data["f"] + "(" + ",".join(arguments) + ")"
 
 
-def split_callstring(raw):
-    """Converts callString into call_list."""
-    open_bracket = {'(', '{', '['}
-    close_bracket = {')', '}', ']'}
-    call_list = []
-    buf = ''
-    in_brackets = 0
-    in_quotes = False
-    dot_legal = True
+# ---------------------------------------------------
+#                Lexer and Parser                  -
+# ---------------------------------------------------
+# One group per token kind, exactly one group matches per token.
+_token_kinds = ("space", "quote", "open", "close", "dot", "word", "error")
+_token_pattern = re.compile(r"""
+    (\s+)
+    |(["'][^"']*["'])
+    |([(\[{])
+    |([)\]}])
+    |(\.)
+    |([^\s"'()\[\]{}.]+)
+    |(.)
+""", re.VERBOSE | re.DOTALL)
+
+
+def tokenize(raw):
+    """Yields the (kind, text, pos) tokens of callString in a single pass.
+
+    Token kinds are "space", "quote", "open", "close", "dot" and "word".
+    Either quote character closes a quote. This matches how udebs has always read quotes.
+    """
+    for match in _token_pattern.finditer(raw):
+        kind = _token_kinds[match.lastindex - 1]
+        if kind == "error":
+            raise errors.UdebsSyntaxError(f"Quotes are mismatched. '{raw}'", match.start())
+
+        yield kind, match.group(), match.start()
+
+
+class Word:
+    """A whitespace separated entry of a callString.
+
+    text - Source text of the entry.
+    pos - Index of the entry in the source string.
+    pieces - Parts of an entry without dots. Bracketed groups are Expressions, everything else is text.
+    segments - Dot separated parts of the entry, [self] if there are no dots.
+    """
+    __slots__ = ("text", "pos", "pieces", "segments")
+
+    def __init__(self, text, pos, pieces=None, segments=None):
+        self.text = text
+        self.pos = pos
+        self.pieces = pieces
+        self.segments = [self] if segments is None else segments
+
+    def __repr__(self):
+        return f"<Word {self.text!r} at {self.pos}>"
+
+    def group(self):
+        """Returns the inner expression if this entry is a single bracketed group."""
+        if self.pieces is not None and len(self.pieces) == 1 and isinstance(self.pieces[0], Expression):
+            return self.pieces[0]
 
-    for char in raw.strip():
+    def prefixed(self, modules):
+        """Tests if this entry uses prefix notation. (-value, #entity)"""
+        return self.text not in modules and self.text[0] in modules and isinstance(self.pieces[0], str)
 
-        if char in {'"', "'"}:
-            in_quotes = not in_quotes
+    def strip(self):
+        """Returns this entry with the prefix character removed."""
+        first, *rest = self.pieces
+        if len(first) > 1:
+            rest.insert(0, first[1:])
+        return Word(self.text[1:], self.pos + 1, rest)
 
-        elif not in_quotes:
-            if char in open_bracket:
-                in_brackets += 1
 
-            elif char in close_bracket:
-                in_brackets -= 1
+class Expression:
+    """A parsed callString. A list of whitespace separated words."""
+    __slots__ = ("text", "pos", "words")
 
-            elif not in_brackets:
-                if dot_legal:
-                    if char == ".":
-                        call_list.append(buf)
-                        buf = ''
-                        continue
+    def __init__(self, text, pos, words):
+        self.text = text
+        self.pos = pos
+        self.words = words
 
-                    elif char.isspace():
-                        dot_legal = False
-                        if call_list:
-                            call_list = [".".join(call_list) + "." + buf]
-                            buf = ''
+    def __repr__(self):
+        return f"<Expression {self.text!r} at {self.pos}>"
+
+
+def _word(raw, segments, pieces, word_start, segment_start, end):
+    """Closes the word currently being parsed."""
+    if not pieces:
+        raise errors.UdebsSyntaxError(f"Empty element in call_list. '{raw}'", end)
+
+    segments.append(Word(raw[segment_start:end], segment_start, pieces))
+    if len(segments) == 1:
+        return segments[0]
+    return Word(raw[word_start:end], word_start, segments=segments)
+
+
+def parse(raw):
+    """Converts callString into an Expression tree in a single pass over its tokens."""
+    stack = []
+    words, segments, pieces = [], [], []
+    start = word_start = segment_start = 0
+
+    # Contents of [] and {} brackets are passed through to python untouched.
+    depth = 0
+    opaque = 0
+
+    for kind, text, pos in tokenize(raw):
+        if depth:
+            if kind == "open":
+                depth += 1
+            elif kind == "close":
+                depth -= 1
+                if not depth:
+                    pieces.append(raw[opaque:pos + 1])
+
+        elif kind == "space":
+            if pieces or segments:
+                words.append(_word(raw, segments, pieces, word_start, segment_start, pos))
+                segments, pieces = [], []
+
+        elif kind == "dot":
+            if not pieces:
+                raise errors.UdebsSyntaxError(f"Empty element in call_list. '{raw}'", pos)
+            segments.append(Word(raw[segment_start:pos], segment_start, pieces))
+            pieces = []
+            segment_start = pos + 1
+
+        elif kind == "close":
+            if pieces or segments:
+                words.append(_word(raw, segments, pieces, word_start, segment_start, pos))
+            if not stack or text != ")":
+                raise errors.UdebsSyntaxError(f"Brackets are mismatched. '{raw}'", pos)
+            if not words:
+                raise errors.UdebsSyntaxError(f"Empty element in call_list. '{raw}'", start)
+
+            expr = Expression(raw[start:pos], start, words)
+            words, segments, pieces, start, word_start, segment_start, _ = stack.pop()
+            pieces.append(expr)
 
-                if char.isspace():
-                    if buf:
-                        call_list.append(buf)
-                        buf = ''
-                    continue
+        else:
+            if not pieces and not segments:
+                word_start = segment_start = pos
+
+            if kind != "open":
+                pieces.append(text)
+            elif text == "(":
+                stack.append((words, segments, pieces, start, word_start, segment_start, pos))
+                words, segments, pieces = [], [], []
+                start = pos + 1
+            else:
+                depth = 1
+                opaque = pos
 
-        buf += char
-    call_list.append(buf)
+    if depth or stack:
+        opened = opaque if depth else stack[-1][-1]
+        raise errors.UdebsSyntaxError(f"Brackets are mismatched. '{raw}'", opened)
 
-    if in_brackets:
-        raise errors.UdebsSyntaxError(f"Brackets are mismatched. '{raw}'")
+    if pieces or segments:
+        words.append(_word(raw, segments, pieces, word_start, segment_start, len(raw)))
 
-    if '' in call_list:
-        raise errors.UdebsSyntaxError(f"Empty element in call_list. '{raw}'")
+    if not words:
+        raise errors.UdebsSyntaxError(f"Empty element in call_list. '{raw}'", start)
 
-    # Length one special cases.
-    if len(call_list) == 1:
-        value = call_list[0]
+    return Expression(raw, 0, words)
 
-        # Prefix calling.
-        if value not in Variables.modules:
-            if value[0] in Variables.modules:
-                return [value[0], value[1:]]
 
-    return call_list
+def _entry(word, debug, registry):
+    """Converts a single word into python source or a raw argument for call."""
+    group = word.group()
+    if group is not None:
+        return _generate(group, debug, registry=registry)
+    elif len(word.segments) > 1 or word.prefixed(registry.modules):
+        return _generate(Expression(word.text, word.pos, [word]), debug, registry=registry)
+    return word.text
 
 
-def interpret(string, debug=False, root=False):
-    """Recursive function that parses callString"""
+def _generate(expr, debug=False, root=False, registry=None):
+    """Converts an Expression tree into a python function string."""
+    words = expr.words
+    if len(words) == 1:
+        word = words[0]
+        if len(word.segments) > 1:
+            words = word.segments
+        elif word.prefixed(registry.modules):
+            words = [Word(word.text[0], word.pos, [word.text[0]]), word.strip()]
+
+    found = [_entry(i, debug, registry) for i in words]
+    if debug:
+        print("Interpret:", expr.text)
+        print("Split:", [i.text for i in words])
+
     try:
-        _list = split_callstring(string)
-        if debug:
-            print("Interpret:", string)
-            print("Split:", _list)
-
-        found = []
-        for entry in _list:
-            if entry[0] == "(" and entry[-1] == ")":
-                found.append(interpret(entry[1:-1], debug))
-            elif "." in entry:
-                found.append(interpret(entry, debug))
-            elif entry[0] in Variables.modules and entry not in Variables.modules:
-                found.append(interpret(entry, debug))
-            else:
-                found.append(entry)
+        comp = call(found, root=root, registry=registry)
+    except errors.UdebsSyntaxError as e:
+        if e.pos is None:
+            e.pos = expr.pos
+        raise
 
-        comp = call(found, root=root)
-        if debug:
-            print("call:", _list)
-            print("computed:", comp)
+    if debug:
+        print("call:", found)
+        print("computed:", comp)
 
-        return comp
+    return comp
 
+
+def interpret(string, debug=False, root=False, registry=None):
+    """Converts callString into a python function string."""
+    if registry is None:
+        registry = Variables
+
+    try:
+        return _generate(parse(string), debug, root, registry)
     except Exception:
         print(string)
         raise
 
 
+# ---------------------------------------------------
+#                   Optimizer                      -
+# ---------------------------------------------------
+_literal_types = (bool, int, float, str, type(None))
+
+
+def _is_literal(value):
+    if isinstance(value, tuple):
+        return all(_is_literal(i) for i in value)
+    return isinstance(value, _literal_types)
+
+
+class _FoldError(Exception):
+    pass
+
+
+class _Opaque:
+    """Stands in for an argument that is not a literal while folding.
+
+    Any attempt to inspect it aborts the fold. If the function returns it untouched
+    the call can be replaced by that argument.
+    """
+    __slots__ = ()
+
+    def _abort(self, *args, **kwargs):
+        raise _FoldError
+
+    __bool__ = __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = __hash__ = _abort
+    __len__ = __iter__ = __contains__ = __getitem__ = __index__ = __int__ = __float__ = _abort
+    __str__ = __repr__ = __format__ = __getattr__ = _abort
+
+
+def _pure_functions(registry):
+    """Maps the python name of every pure keyword to its function."""
+    pure, impure = set(), set()
+    for data in registry.modules.values():
+        (pure if data.get("pure", registry.default["pure"]) else impure).add(data["f"])
+
+    found = {}
+    for name in pure - impure:
+        try:
+            found[name] = eval(name, registry.env)
+        except Exception:
+            continue
+    return found
+
+
+class _Thunk:
+    """Stands in for a lazy argument while folding. Counts how often it was evaluated."""
+    __slots__ = ("value", "calls")
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def _is_thunk(node):
+    """Tests if node is a lazy argument created by thunk."""
+    return isinstance(node, ast.Lambda) and [i.arg for i in node.args.args] == ["self", "storage"]
+
+
+def _call_name(node):
+    """Returns the dotted name a call is made through, or None if it is not a plain name."""
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Attribute):
+        value = _call_name(node.value)
+        if value is not None:
+            return value + "." + node.attr
+
+
+class _Folder(ast.NodeTransformer):
+    """Folds calls to pure functions whose arguments are literals.
+
+    Arguments that are not literals are passed in as _Opaque placeholders. A call that only
+    passes one of them through (if true x y) is replaced by that argument, dropping the others.
+    Arguments are only dropped if they only call pure functions. Lazy arguments the function
+    never evaluated would not have run anyway and are dropped regardless.
+    """
+
+    def __init__(self, pure):
+        self.pure = pure
+
+    def side_effect_free(self, node):
+        """Only calls to pure functions are known not to change the game or raise."""
+        for child in ast.walk(node):
+            if isinstance(child, ast.NamedExpr):
+                return False
+            if isinstance(child, ast.Call) and _call_name(child.func) not in self.pure:
+                return False
+        return True
+
+    def value(self, node, opaque, thunks, lazy=False):
+        if _is_thunk(node):
+            placeholder = _Thunk(self.value(node.body, opaque, thunks, lazy=True))
+            thunks.append((placeholder, node.body))
+            return placeholder
+
+        try:
+            return ast.literal_eval(node)
+        except Exception:
+            pass
+
+        placeholder = _Opaque()
+        opaque.append((placeholder, node, lazy))
+        return placeholder
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = self.pure.get(_call_name(node.func))
+        if func is None:
+            return node
+
+        opaque, thunks = [], []
+        try:
+            if any(isinstance(arg, ast.Starred) for arg in node.args) or any(k.arg is None for k in node.keywords):
+                return node
+            args = [self.value(arg, opaque, thunks) for arg in node.args]
+            kwargs = {k.arg: self.value(k.value, opaque, thunks) for k in node.keywords}
+            result = func(*args, **kwargs)
+        except Exception:
+            return node
+
+        found = None
+        for placeholder, arg, lazy in opaque:
+            if result is placeholder:
+                found = arg
+
+        if found is None and not _is_literal(result):
+            return node
+
+        # Dropped arguments may only disappear if they had no side effects and can not raise.
+        for placeholder, arg, lazy in opaque:
+            if arg is not found and not lazy and not self.side_effect_free(arg):
+                return node
+
+        # Evaluated lazy arguments may only disappear if they had no side effects.
+        for placeholder, body in thunks:
+            allowed = 1 if body is found else 0
+            if placeholder.calls > allowed and not self.side_effect_free(body):
+                return node
+
+        if found is not None:
+            return found
+        return ast.copy_location(ast.Constant(result), node)
+
+
+# Names of an Instance's stats, lists and strings. Lets the compiler specialize STAT calls.
+Schema = namedtuple("Schema", ["stats", "lists", "strings"])
+
+# Getter used for each kind of stat when the stat name is known, see Instance.getStat.
+_stat_getters = (("stats", "_getStatSum"), ("lists", "_getStatList"), ("strings", "_getStatString"))
+
+
+class _Specializer(ast.NodeTransformer):
+    """Replaces generic getters with direct ones when their arguments are known literals.
+
+    getStat(self, x, 'stat') calls the getter for that kind of stat, skipping type dispatch at runtime.
+    """
+
+    def __init__(self, registry, schema):
+        self.env = registry.env
+        self.schema = schema
+
+    def resolves(self, name, qualname):
+        return getattr(self.env.get(name), "__qualname__", None) == qualname
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.func, ast.Name) or node.keywords or not node.args:
+            return node
+
+        name, args = node.func.id, node.args
+        if not (isinstance(args[0], ast.Name) and args[0].id == "self"):
+            return node
+
+        if name == "getStat" and len(args) in (3, 4) and self.resolves(name, "Instance.getStat"):
+            stat = args[2]
+            inherit = args[3] if len(args) == 4 else ast.Constant(True)
+            if not (isinstance(stat, ast.Constant) and isinstance(inherit, ast.Constant) and inherit.value):
+                return node
+
+            for kind, getter in _stat_getters:
+                if stat.value in getattr(self.schema, kind) and getter in self.env:
+                    return ast.copy_location(ast.Call(ast.Name(getter, ast.Load()), args[:3], []), node)
+
+        return node
+
+
+def optimize(source, registry=None, schema=None):
+    """Constant folds calls to pure keywords in interpreted python source.
+
+    If schema is given calls to getters are specialized for the stats it defines.
+    Returns source unchanged if nothing could be changed.
+    """
+    if registry is None:
+        registry = Variables
+
+    tree = ast.parse(source, mode="eval")
+    before = ast.unparse(tree)
+    tree = _Folder(registry.pure()).visit(tree)
+    if schema is not None:
+        tree = _Specializer(registry, schema).visit(tree)
+
+    folded = ast.unparse(tree)
+    if folded == before:
+        return source
+    return folded
+
+
+# ---------------------------------------------------
+#                  Script Cache                    -
+# ---------------------------------------------------
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+
+class ScriptCache:
+    """Size bounded lru cache of interpreted and compiled scripts keyed by source text.
+
+    maxsize - Maximum number of scripts to hold before the least recently used is evicted.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.storage = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.storage)
+
+    def __contains__(self, key):
+        return key in self.storage
+
+    def get(self, key):
+        """Returns the cached value for key or None, recording a hit or a miss."""
+        value = self.storage.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.storage.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Stores value under key, evicting old entries if the cache is full."""
+        self.storage[key] = value
+        self.storage.move_to_end(key)
+        while len(self.storage) > self.maxsize:
+            self.storage.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Empties the cache. Counters are left untouched."""
+        self.storage.clear()
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self.storage))
+
+
+script_cache = ScriptCache()
+
+
 # ---------------------------------------------------
 #                Script Main Class                 -
 # ---------------------------------------------------
 class Script:
-    """Storage class for interpreted code ready for the eval function."""
-    def __init__(self, effect, debug=False, skip_interpret=False):
+    """Storage class for interpreted code ready for the eval function.
+
+    Identical source strings are only interpreted and compiled once per registry version, see script_cache.
+
+    schema - Schema of the Instance the script belongs to. Lets STAT and # compile to direct lookups.
+    """
+    def __init__(self, effect, debug=False, skip_interpret=False, registry=None, schema=None):
+        if registry is None:
+            registry = Variables
+
         # Raw text given to script.
         self.raw = None if skip_interpret else effect
-        self.interpret = effect if skip_interpret else interpret(effect, debug, root=True)
+        self.schema = schema
+
+        key = (registry.version, effect, skip_interpret, schema)
+        compiled = None if debug else script_cache.get(key)
+        if compiled is None:
+            if skip_interpret:
+                source = effect
+            else:
+                source = optimize(interpret(effect, debug, root=True, registry=registry), registry, schema)
+                if debug:
+                    print("optimized:", source)
+            compiled = (source, compile(source, '<string>', "eval"))
+            if not debug:
+                script_cache.put(key, compiled)
+
+        self.interpret, self.code = compiled
+
+    def __getstate__(self):
+        # Code objects can not be pickled, the source is compiled again when loaded.
+        state = dict(self.__dict__)
+        del state["code"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
         self.code = compile(self.interpret, '<string>', "eval")
 
     def __repr__(self):
@@ -244,16 +788,117 @@ class Script:
         return self.raw == other.raw
 
 
+def _fuse_source(requires, effects):
+    """Writes the python source for a function running every require then every effect in order."""
+    lines = [
+        "def _factory(_requires, _effects, _error, RecursionError, Exception):",
+        "    def fused(self, storage, force=False, effects=True):",
+        "        if not force:",
+        "            pass",
+    ]
+    for i, require in enumerate(requires):
+        lines.extend([
+            "            try:",
+            f"                _value = ({require.interpret}\n)",
+            "            except RecursionError:",
+            "                raise",
+            "            except Exception:",
+            f"                raise _error(_requires[{i}])",
+            "            if not _value:",
+            f"                return _requires[{i}]",
+        ])
+    lines.extend([
+        "        if effects:",
+        "            pass",
+    ])
+    for i, effect in enumerate(effects):
+        lines.extend([
+            "            try:",
+            f"                ({effect.interpret}\n)",
+            "            except Exception:",
+            f"                raise _error(_effects[{i}])",
+        ])
+    lines.extend([
+        "        return None",
+        "    return fused",
+    ])
+    return "\n".join(lines)
+
+
+def fuse(requires, effects, registry=None):
+    """Compiles a list of require scripts and a list of effect scripts into a single function.
+
+    The function is called as fused(self, storage, force=False, effects=True) and behaves like
+    Entity.__call__. It returns the first failing require script or None on success.
+    Returns None if the scripts can not be combined, callers should fall back to calling each script.
+    """
+    if registry is None:
+        registry = Variables
+
+    key = ("fuse", registry.version, tuple(i.interpret for i in requires), tuple(i.interpret for i in effects))
+    factory = script_cache.get(key)
+    if factory is None:
+        try:
+            code = compile(_fuse_source(requires, effects), "<fused>", "exec")
+        except SyntaxError:
+            return None
+
+        local = {}
+        exec(code, registry.env, local)
+        factory = local["_factory"]
+        script_cache.put(key, factory)
+
+    return factory(tuple(requires), tuple(effects), errors.UdebsExecutionError, RecursionError, Exception)
+
+
+# Getters that only read the entity passed to them, never where it is. See entity_only.
+_entity_getters = {
+    "getName", "getStat", "getEntity", "getListGroup", "__getitem__",
+    "_getStatSum", "_getStatList", "_getStatString",
+}
+
+
+def entity_only(scripts, registry=None):
+    """Tests if scripts only call pure functions and getters of entity data.
+
+    Their result then depends on which entities they are given, not where those entities are
+    or on chance, so it can be reused for any copy of the same immutable entity.
+    """
+    if registry is None:
+        registry = Variables
+
+    key = ("entity_only", registry.version, tuple(i.interpret for i in scripts))
+    value = script_cache.get(key)
+    if value is None:
+        pure = registry.pure()
+        value = True
+        for script in scripts:
+            for node in ast.walk(ast.parse(script.interpret, mode="eval")):
+                if isinstance(node, ast.NamedExpr):
+                    value = False
+                elif isinstance(node, ast.Call):
+                    name = _call_name(node.func) or ""
+                    if name not in pure and name.split(".")[-1] not in _entity_getters:
+                        value = False
+        script_cache.put(key, value)
+
+    return value
+
+
 # ---------------------------------------------------
 #                     Runtime                      -
 # ---------------------------------------------------
-def _register_raw(func, local=None, globs=None, name=None):
+def _register_raw(func, local=None, globs=None, name=None, registry=None):
     """Use this to register a function without using a decorator.
     func - The function to register
     local - Local call pattern for given function.
     globs - Dictionary of global objects to add to udebs.
     name - Name to give function (defaults to func.__name__)
+    registry - Registry to add the function to (defaults to Variables)
     """
+    if registry is None:
+        registry = Variables
+
     if name is None and not hasattr(func, "__name__"):
         raise errors.UdebsSyntaxError("Must set name attribute when registering a class object.")
 
@@ -277,15 +922,24 @@ def _register_raw(func, local=None, globs=None, name=None):
 
     globs[f_name] = func() if inspect.isclass(func) else func
 
-    Variables.modules.update(local_vars)
-    Variables.env.update(globs)
+    # Compiled scripts are keyed on the registry version, so nothing cached goes stale.
+    registry.modules.update(local_vars)
+    registry.env.update(globs)
     return func
 
 
-def register(function, *args, name=None):
+def register(function, *args, name=None, registry=None):
     """Register a function with udebs using a decorator.
 
     name - keyword used to signify this function from within udebs.
+    registry - Registry to add the keyword to. Defaults to the global registry Variables.
+
+    Setting "pure": True in the call pattern promises the function has no side effects and
+    always returns the same value for the same arguments. Calls with literal arguments are
+    then evaluated once when the script is compiled, see optimize.
+
+    Arguments listed in "lazy" (or every argument if "lazy": True) are passed as functions
+    taking no arguments. They are only evaluated if the registered function calls them.
 
     .. code-block:: python
 
@@ -304,6 +958,6 @@ def register(function, *args, name=None):
 
     """
     if hasattr(function, "__call__"):
-        return _register_raw(function, *args, name=name)
+        return _register_raw(function, *args, name=name, registry=registry)
 
-    return lambda f: _register_raw(f, function, *args, name=name)
+    return lambda f: _register_raw(f, function, *args, name=name, registry=registry)
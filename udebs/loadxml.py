@@ -1,5 +1,7 @@
 import re
-from udebs import instance
+from udebs import bundle as bundles, instance
+from udebs.board import ArrayBoard
+from udebs.interpret import Variables
 from xml.etree import ElementTree
 
 
@@ -55,10 +57,16 @@ def battleWrite(env, location, pretty=False):
         add_leaf(config, "logging", str(env.logging))
     if env.revert != 0:
         add_leaf(config, "revert", str(env.revert))
+    if env.keyframe != 1:
+        add_leaf(config, "keyframe", str(env.keyframe))
     if env.seed is not None:
         add_leaf(config, "seed", str(env.seed))
     if env.immutable is not True:
         add_leaf(config, "immutable", str(env.immutable))
+    if env.fuse:
+        add_leaf(config, "fuse", str(env.fuse))
+    if env.cow:
+        add_leaf(config, "cow", str(env.cow))
 
     # Time variables
     var = e.SubElement(root, 'var')
@@ -81,6 +89,8 @@ def battleWrite(env, location, pretty=False):
             node.attrib['empty'] = map_.empty
         if map_.type is not False:
             node.attrib['type'] = map_.type
+        if isinstance(map_, ArrayBoard):
+            node.attrib['store'] = 'array'
         for row in (list(i) for i in zip(*map_.map)):
             add_leaf(node, "row", ", ".join(row))
 
@@ -147,7 +157,7 @@ def _parse_map(field_map2):
     options2 = {"name": field_map2.tag}
 
     # Attributes
-    for att in ("empty", "rmap", "type"):
+    for att in ("empty", "rmap", "type", "store"):
         if field_map2.get(att) is not None:
             options2[att] = field_map2.get(att)
 
@@ -169,16 +179,23 @@ def _parse_map(field_map2):
 
 
 # Creates and instance object from xml file.
-def battleStart(xml_file=None, field=instance.Instance, **overwrite):
+def battleStart(xml_file=None, field=instance.Instance, bundle=None, **overwrite):
     """
     Creates an instance object from given xml file.
 
     xml_file - String representing file to look in.
     debug - Boolean that gets passed to the interpret function.
     script - Override the script that runs after initialization
+    bundle - Path to a precompiled script bundle. Used if it matches xml_file and the registered
+             keywords, otherwise it is rebuilt. See udebs.bundle.
     """
     if xml_file is None:
         xml_file = "<udebs />"
+
+    if bundle is not None:
+        registry = overwrite.get("registry", Variables)
+        key = (bundles.content_hash(xml_file), bundles.signature(registry))
+        loaded = bundles.load(bundle, key, registry)
     try:
         tree = ElementTree.parse(xml_file)
         root = tree.getroot()
@@ -209,8 +226,9 @@ def battleStart(xml_file=None, field=instance.Instance, **overwrite):
     # Config
     config = root.find("config")
     if config is not None:
-        for value, f in [("name", str), ("revert", int), ("logging", eval), ("seed", int),
-                         ("immutable", eval)]:
+        for value, f in [("name", str), ("revert", int), ("keyframe", int), ("logging", eval), ("seed", int),
+                         ("immutable", eval), ("fuse", eval), ("cow", eval),
+                         ("profile", eval)]:
             tmp = config.findtext(value)
             if tmp is not None:
                 options[value] = f(tmp)
@@ -278,4 +296,8 @@ def battleStart(xml_file=None, field=instance.Instance, **overwrite):
 
     options.update(overwrite)
 
-    return field(**options)
+    new = field(**options)
+    if bundle is not None and not loaded:
+        bundles.dump(bundle, key, new)
+
+    return new
@@ -0,0 +1,261 @@
+"""
+Opt in profiler for udebs scripts and keywords.
+
+Enable it with Instance(profile=True) or <profile>True</profile> in the xml config,
+play the game, then inspect instance.profiler.
+
+.. code-block:: python
+
+    field = udebs.battleStart("game.xml", profile=True)
+    ...
+    print(field.profiler.report())
+    field.profiler.dump_stats("game.prof")  # readable by pstats and snakeviz
+    field.profiler.dump_json("game.json")
+
+Every require and effect script and every keyword called from a script is recorded
+with its call count, failures, cumulative time and self time (time not spent in
+other recorded scripts or keywords).
+
+Note: Keywords whose function is reached through self or storage (DICE, $) can not be
+intercepted and are counted as part of their script. Moves compiled with the fuse
+option are evaluated script by script while profiling.
+"""
+import functools
+import json
+import marshal
+import time
+
+from udebs import errors
+
+
+class Entry:
+    """Accumulated statistics of one script or keyword."""
+    __slots__ = ("calls", "failures", "cumtime", "selftime", "active", "callers")
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.cumtime = 0.0
+        self.selftime = 0.0
+        # Number of unfinished calls, cumulative time is only counted for the outermost one.
+        self.active = 0
+        # caller key -> [calls, cumtime, selftime]
+        self.callers = {}
+
+    @property
+    def failure_rate(self):
+        return self.failures / self.calls if self.calls else 0.0
+
+
+class _Namespace:
+    """Stands in for a module (operator) so keywords like operator.gt can be intercepted."""
+
+    def __init__(self, module, wrapped):
+        self._module = module
+        self.__dict__.update(wrapped)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+class Profiler:
+    """Records timings of scripts and keywords. See module documentation."""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        # (kind, name) -> Entry. kind is "script", "keyword" or "function".
+        self.entries = {}
+        # One [key, start, time spent in children] per unfinished call.
+        self.stack = []
+        self._envs = {}
+
+    # ---------------------------------------------------
+    #                   Recording                      -
+    # ---------------------------------------------------
+    def enter(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = Entry()
+
+        entry.active += 1
+        self.stack.append([key, self.clock(), 0.0])
+
+    def exit(self, failed=False):
+        key, start, children = self.stack.pop()
+        elapsed = self.clock() - start
+        entry = self.entries[key]
+
+        entry.active -= 1
+        entry.calls += 1
+        entry.selftime += elapsed - children
+        if failed:
+            entry.failures += 1
+        if not entry.active:
+            entry.cumtime += elapsed
+
+        if self.stack:
+            parent = self.stack[-1]
+            parent[2] += elapsed
+            edge = entry.callers.setdefault(parent[0], [0, 0.0, 0.0])
+        else:
+            edge = entry.callers.setdefault(None, [0, 0.0, 0.0])
+
+        edge[0] += 1
+        edge[1] += elapsed
+        edge[2] += elapsed - children
+
+    def clear(self):
+        self.entries.clear()
+        self.stack.clear()
+
+    def _wrap(self, key, func):
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            self.enter(key)
+            failed = True
+            try:
+                value = func(*args, **kwargs)
+                failed = False
+                return value
+            finally:
+                self.exit(failed)
+
+        return wrapped
+
+    def env(self, registry):
+        """Returns a copy of registry.env where every keyword function records its calls."""
+        version, env = self._envs.get(registry, (None, None))
+        if version == registry.version:
+            return env
+
+        labels = {}
+        for name, data in registry.modules.items():
+            labels.setdefault(data.get("f", ""), []).append(name)
+
+        builtins = registry.env.get("__builtins__", {})
+        env = dict(registry.env)
+        namespaces = {}
+
+        for f, names in labels.items():
+            key = ("keyword", "/".join(sorted(names)) + f" ({f})")
+            root, _, attr = f.partition(".")
+            if not attr:
+                func = registry.env.get(f, builtins.get(f))
+                if callable(func):
+                    env[f] = self._wrap(key, func)
+            elif "." not in attr and root in registry.env and root not in ("self", "storage"):
+                module = registry.env[root]
+                func = getattr(module, attr, None)
+                if callable(func):
+                    namespaces.setdefault(root, {})[attr] = self._wrap(key, func)
+
+        for root, wrapped in namespaces.items():
+            env[root] = _Namespace(registry.env[root], wrapped)
+
+        # Remaining functions, such as the getters emitted by the compiler.
+        for name, func in registry.env.items():
+            if name not in labels and not name.startswith("__") and callable(func) and not isinstance(func, type):
+                env[name] = self._wrap(("function", name), func)
+
+        self._envs[registry] = (registry.version, env)
+        return env
+
+    # ---------------------------------------------------
+    #           Instrumented Entity functions          -
+    # ---------------------------------------------------
+    @staticmethod
+    def _label(script):
+        return ("script", script.interpret if script.raw is None else script.raw)
+
+    def test(self, entity, env):
+        """Entity.test while recording every require."""
+        state = env["self"]
+        globs = self.env(state.registry)
+        for require in state.getStat(entity, 'require'):
+            self.enter(self._label(require))
+            value = None
+            try:
+                value = eval(require.code, globs, env)
+            except RecursionError:
+                raise
+            except Exception:
+                raise errors.UdebsExecutionError(require)
+            finally:
+                self.exit(not value)
+
+            if not value:
+                return require
+
+    def call(self, entity, env, force=False):
+        """Entity.__call__ while recording every require and effect."""
+        if not force:
+            value = self.test(entity, env)
+            if value is not None:
+                return value
+
+        state = env["self"]
+        globs = self.env(state.registry)
+        for effect in state.getStat(entity, 'effect'):
+            self.enter(self._label(effect))
+            failed = True
+            try:
+                eval(effect.code, globs, env)
+                failed = False
+            except Exception:
+                raise errors.UdebsExecutionError(effect)
+            finally:
+                self.exit(failed)
+
+    # ---------------------------------------------------
+    #                    Reports                       -
+    # ---------------------------------------------------
+    def stats(self, sort="cumtime"):
+        """Returns one dictionary per script or keyword, most expensive first."""
+        rows = []
+        for (kind, name), entry in self.entries.items():
+            rows.append({
+                "kind": kind,
+                "name": name,
+                "calls": entry.calls,
+                "failures": entry.failures,
+                "failure_rate": entry.failure_rate,
+                "cumtime": entry.cumtime,
+                "selftime": entry.selftime,
+            })
+
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows
+
+    def report(self, sort="cumtime", limit=20):
+        """Returns a printable table of the most expensive scripts and keywords."""
+        lines = [f"{'calls':>9} {'fail%':>6} {'cumtime':>10} {'selftime':>10}  name"]
+        for row in self.stats(sort)[:limit]:
+            lines.append(
+                f"{row['calls']:>9} {row['failure_rate'] * 100:>6.1f} {row['cumtime']:>10.6f} "
+                f"{row['selftime']:>10.6f}  {row['kind']}: {row['name']}"
+            )
+        return "\n".join(lines)
+
+    def dump_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.stats(), f, indent=2)
+
+    @staticmethod
+    def _function(key):
+        """pstats identifies functions by (file, line, name)."""
+        kind, name = key
+        return f"<udebs {kind}>", 0, name
+
+    def dump_stats(self, path):
+        """Writes the statistics in the marshal format of pstats.Stats and cProfile."""
+        data = {}
+        for key, entry in self.entries.items():
+            callers = {}
+            for caller, (calls, cumtime, selftime) in entry.callers.items():
+                if caller is not None:
+                    callers[self._function(caller)] = (calls, calls, selftime, cumtime)
+
+            data[self._function(key)] = (entry.calls, entry.calls, entry.selftime, entry.cumtime, callers)
+
+        with open(path, "wb") as f:
+            marshal.dump(data, f)
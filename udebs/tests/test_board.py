@@ -1,6 +1,6 @@
 import udebs
 import os
-from pytest import raises
+from pytest import importorskip, raises
 import copy
 
 
@@ -72,6 +72,21 @@ class TestBoardClass:
         del self.two[0, 0]
         assert self.two[0, 0] == "immune"
 
+    def test_cow(self):
+        three = self.two.copy(cow=True)
+        assert three.map[0] is self.two.map[0]
+        three[0, 0] = "unit2"
+        assert self.two[0, 0] == "unit1"
+        assert three.map[1] is self.two.map[1]
+
+    def test_hash(self):
+        start = self.two.getHash()
+        self.two[0, 0] = "unit2"
+        assert self.two.getHash() != start
+        del self.two[0, 0]
+        self.two[0, 0] = "unit1"
+        assert self.two.getHash() == start
+
     def test_eq(self):
         assert self.two != "two"
 
@@ -82,6 +97,47 @@ class TestBoardClass:
         assert repr(self.two) == "<board: two>"
 
 
+class TestArrayBoard:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.test = udebs.battleStart(path + "/test.xml")
+        self.two = self.test.map["two"]
+        self.array = udebs.ArrayBoard(name="two", empty="immune", dim=[i[:] for i in self.two.map])
+
+    def test_equal(self):
+        assert self.array == self.two
+        assert list(self.array.values()) == list(self.two.values())
+        assert self.array[1, 0] == "unit2"
+
+        with raises(IndexError):
+            self.array[0, 3]
+        with raises(IndexError):
+            self.array[-1, 0] = "unit1"
+
+    def test_change(self):
+        self.array[1, 2] = "unit1"
+        del self.array[0, 0]
+        self.two[1, 2] = "unit1"
+        del self.two[0, 0]
+        assert self.array == self.two
+        assert self.array.getHash() == self.two.getHash()
+
+    def test_copy(self):
+        for cow in (False, True):
+            new = self.array.copy(cow=cow)
+            new[0, 0] = "unit2"
+            assert self.array[0, 0] == "unit1"
+            assert new[0, 0] == "unit2"
+
+    def test_view(self):
+        numpy = importorskip("numpy")
+        view = self.array.view()
+        assert view.shape == (2, 3)
+        assert self.array.names[view[1, 0]] == "unit2"
+        assert not view.flags.writeable
+        assert isinstance(view, numpy.ndarray)
+
+
 class TestPathing:
     def setup(self):
         path = os.path.dirname(__file__)
@@ -171,3 +227,92 @@ class TestDirectPathing:
 
     def test_testLoc(self):
         assert self.two.test_loc((0, 0)) is False
+
+    def test_neighbours(self):
+        table = self.map.neighbours
+        assert table is self.map.copy().neighbours
+        assert table.locs[table.index[2, 3, "map"]] == (2, 3, "map")
+        assert set(self.map.adjacent((0, 0, "map"))) == {(1, 0, "map"), (0, 1, "map"), (1, 1, "map")}
+        assert set(self.map.adjacent((-1, 0, "map"))) == {(0, 0, "map"), (0, 1, "map")}
+
+        for type_, count in ((False, 4), ("hex", 6), ("diag", 8)):
+            board = udebs.Board(name="test", dim=(3, 3), type=type_)
+            assert len(board.adjacent((1, 1, "test"))) == count
+
+    def test_path(self):
+        for y in range(5):
+            self.map[2, y] = "immune"
+
+        notempty = self.test["notempty"]
+        bfs = self.map.get_path((0, 0, "map"), (4, 0, "map"), callback=notempty, state=self.test)
+        assert len(bfs) == 11
+        for method in ("astar", "bidirectional"):
+            path = self.map.get_path((0, 0, "map"), (4, 0, "map"), method, callback=notempty, state=self.test)
+            assert len(path) == len(bfs)
+            assert path[0] == (0, 0, "map") and path[-1] == (4, 0, "map")
+            assert all(self.map[loc] != "immune" for loc in path)
+
+            assert self.map.get_path((0, 0, "map"), (2, 0, "map"), method, callback=notempty, state=self.test) == []
+            assert self.map.get_path((0, 0, "map"), (0, 0, "map"), method) == [(0, 0, "map")]
+
+        self.test.controlTravel(self.test["unit1"], (0, 0, "map"))
+        self.test.controlTravel(self.test["unit2"], (4, 0, "map"))
+        script = udebs.interpret.Script("astar PATH #notempty #unit1 #unit2", registry=self.test.registry)
+        assert len(eval(script.code, self.test.registry.env, {"storage": {}, "self": self.test})) == 11
+
+        with raises(ValueError):
+            self.map.get_path((0, 0, "map"), (4, 0, "map"), "dfs")
+
+    def test_weighted(self):
+        board = udebs.Board(name="test", dim=(5, 5))
+        cost = {(x, y, "test"): 5 if x == 2 else 1 for x in range(5) for y in range(5)}.get
+
+        path = board.get_weighted_path((0, 0, "test"), (4, 0, "test"), cost)
+        assert len(path) == 5
+        assert sum(cost(loc) for loc in path[1:]) == 8
+
+        costs = board.get_costs((0, 0, "test"), cost, 2)
+        assert costs == {(0, 0, "test"): 0, (1, 0, "test"): 1, (0, 1, "test"): 1, (1, 1, "test"): 2, (0, 2, "test"): 2}
+        assert board.get_weighted_fill((0, 0, "test"), cost, 2, include_center=False) == set(costs) - {(0, 0, "test")}
+
+        with raises(ValueError):
+            board.get_costs((0, 0, "test"), lambda loc: -1)
+
+        for y in range(3):
+            self.one[2, y] = "immune"
+        self.test.controlTravel(self.test["unit1"], (0, 0, "one"))
+        self.test.controlTravel(self.test["unit2"], (3, 0, "one"))
+        env = {"storage": {}, "self": self.test}
+        notempty = self.test["notempty"]
+
+        script = udebs.interpret.Script("WFILL #unit1 ACT 0 #notempty", registry=self.test.registry)
+        fill = self.one.get_fill((0, 0, "one"), callback=notempty, state=self.test)
+        assert eval(script.code, self.test.registry.env, env) == sorted(fill)
+
+        script = udebs.interpret.Script("WPATH ACT #unit1 #unit2 #notempty", registry=self.test.registry)
+        path = eval(script.code, self.test.registry.env, env)
+        assert path[0] == (0, 0, "one") and path[-1] == (3, 0, "one")
+        assert all(self.one[loc] != "immune" for loc in path)
+
+    def test_search_filter(self):
+        self.test.controlTravel(self.test["unit1"], (0, 0, "map"))
+        self.map[2, 2] = "immune"
+
+        allows = self.test.searchFilter(self.test["notempty"], self.test["unit1"])
+        assert allows((2, 2, "map")) is False
+        assert allows((1, 3, "map")) is True
+        assert allows((0, 3, "map")) is True
+
+        # The result depends on where the target is, so it is not reused for other empty spaces.
+        allows = self.test.searchFilter(self.test["sideways"], self.test["unit1"])
+        assert allows((0, 3, "map")) is True
+        assert allows((1, 3, "map")) is False
+
+    def test_fill(self):
+        fill = self.map.get_fill((0, 0, "map"), distance=1)
+        assert fill == {(0, 0, "map"), (1, 0, "map"), (0, 1, "map"), (1, 1, "map")}
+        assert len(self.map.get_fill((0, 0, "map"))) == len(self.map)
+        assert self.map.get_fill((0, 0, "map"), distance=0, include_center=False) == set()
+
+        assert self.map.test_block((0, 0, "map"), (4, 5, "map"))
+        assert self.map.test_block((0, 0, "map"), (4, 5, "map"), max_dist=3) is False
@@ -1,6 +1,7 @@
-from udebs.entity import Entity
+from udebs.entity import Entity, entity_class
 import udebs
 import os
+import pickle
 
 
 class TestEntityClass:
@@ -18,6 +19,21 @@ class TestEntityClass:
         unit = self.env["unit1"]
         assert unit == unit.copy()
 
+        new = unit.copy(loc=None)
+        assert new.loc is None and unit.loc is not None
+        assert new.inventory == unit.inventory and new.inventory is not unit.inventory
+
+    def test_layout(self):
+        unit = self.env["unit1"]
+        assert type(unit) is type(self.env["unit2"]) is entity_class(self.env.schema)
+        assert isinstance(unit, Entity)
+        assert not hasattr(unit, "__dict__")
+        assert unit.lists == self.env.lists
+
+        new = pickle.loads(pickle.dumps(unit))
+        assert new == unit
+        assert type(new) is type(unit)
+
     def test_len(self):
         assert len(self.env["unit1"]) == 1
         assert len(list(iter(self.env["unit1"]))) == 1
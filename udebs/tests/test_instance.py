@@ -1,4 +1,8 @@
 import copy
+import json
+import logging
+import pickle
+import pstats
 import udebs
 import os
 from pytest import raises
@@ -43,6 +47,17 @@ class TestInstanceGets:
         with raises(udebs.UndefinedSelectorError):
             self.env.getEntity((-1, 0, "two"))
 
+    def test_get_entity_located(self):
+        immune = self.env.getEntity((0, 1, "two"))
+        assert immune.name == "immune" and immune.loc == (0, 1, "two")
+        assert immune is self.env.getEntity((0, 1, "two"))
+        assert immune is copy.copy(self.env).getEntity((0, 1, "two"))
+        assert self.env.getEntity((1, 1, "two")).loc == (1, 1, "two")
+        assert self.env.getEntity((0, 0)).loc == (0, 0, "map")
+
+        self.env["immune"] = udebs.Entity(self.env, name="immune", immutable=True, ACT=1)
+        assert self.env.getEntity((0, 1, "two")).ACT == 1
+
     def test_getMap(self):
         map_ = self.env.getMap( "two")
         assert self.env.getMap(map_) == map_
@@ -178,3 +193,532 @@ class TestInstanceGets:
         empty = self.env["empty"]
         assert self.env.testMove(empty, empty, self.env["tick"])
         assert self.env.testMove(empty, empty, self.env["move2"]) is False
+
+
+class TestFusedMoves:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml", fuse=True)
+        self.env["mover"] = udebs.Entity(self.env, name="mover", require="(#mover STAT ACT) == 5")
+
+    def test_fused(self):
+        assert self.env.testMove("empty", "empty", "mover") is False
+        assert "mover" in self.env._fused
+
+        self.env.controlIncrement(self.env["mover"], "ACT", 5)
+        assert self.env.testMove("empty", "empty", "mover")
+        assert self.env == copy.copy(self.env)
+
+    def test_invalidate(self):
+        self.env.controlIncrement(self.env["mover"], "ACT", 5)
+        assert self.env.testMove("empty", "empty", "mover")
+
+        self.env["blocker"] = udebs.Entity(self.env, name="blocker", require="(#mover STAT ACT) == 6")
+        self.env.controlListAdd(self.env["mover"], "group", "blocker")
+        assert self.env.testMove("empty", "empty", "mover") is False
+
+        empty = self.env["empty"]
+        env = {"storage": {"caster": empty, "target": empty, "move": self.env["mover"]}, "self": self.env}
+        assert self.env["mover"](env).raw == "(#mover STAT ACT) == 6"
+
+    def test_replace(self):
+        assert self.env.testMove("empty", "empty", "mover") is False
+
+        self.env["mover"] = udebs.Entity(self.env, name="mover", require="(#mover STAT ACT) == 0")
+        assert self.env.testMove("empty", "empty", "mover")
+
+    def test_located(self):
+        assert self.env.testMove("empty", "empty", "mover") is False
+
+        self.env.controlTravel(self.env["mover"], (0, 0, "one"))
+        assert self.env._getFused(self.env["mover"]) is None
+
+    def test_error(self):
+        move = self.env.getQuote("#unit1 nothing CHANGE 1", skip_interpret=False)
+        with raises(udebs.UdebsExecutionError):
+            move({"storage": {}, "self": self.env})
+
+
+class TestProfiler:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml", profile=True)
+        self.env["mover"] = udebs.Entity(self.env, name="mover", require="(#mover STAT ACT) == 5",
+                                         effect="#mover ACT += 1")
+
+    def test_record(self):
+        assert self.env.castMove("empty", "empty", "mover") is False
+        self.env.controlIncrement(self.env["mover"], "ACT", 5)
+        assert self.env.castMove("empty", "empty", "mover")
+
+        entries = self.env.profiler.entries
+        require = entries["script", "(#mover STAT ACT) == 5"]
+        assert require.calls == 2
+        assert require.failures == 1
+        assert entries["script", "#mover ACT += 1"].calls == 1
+        assert entries["keyword", "+=/-=/CHANGE (controlIncrement)"].calls == 1
+        assert entries["keyword", "== (equal)"].calls == 2
+        assert require.cumtime >= require.selftime
+        assert "(#mover STAT ACT) == 5" in self.env.profiler.report()
+
+    def test_dump(self, tmp_path):
+        self.env.castMove("empty", "empty", "mover")
+        path = str(tmp_path / "test.prof")
+
+        self.env.profiler.dump_stats(path)
+        stats = pstats.Stats(path)
+        assert stats.total_calls == sum(i.calls for i in self.env.profiler.entries.values())
+
+        self.env.profiler.dump_json(path)
+        with open(path) as f:
+            assert {row["name"] for row in json.load(f)} >= {"(#mover STAT ACT) == 5"}
+
+
+class TestTrace:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.ring = udebs.trace.RingBufferSink(4)
+        self.env = udebs.battleStart(path + "/test.xml", sinks=[self.ring])
+        self.env["mover"] = udebs.Entity(self.env, name="mover", require="(#mover STAT ACT) == 5",
+                                         effect="#mover ACT += 1")
+
+    def test_events(self):
+        assert self.env.castMove("empty", "empty", "mover", time=0) is False
+        self.env.controlIncrement(self.env["mover"], "ACT", 5)
+        assert self.env.castMove("empty", "empty", "mover", time=0)
+        self.env.controlListAdd(self.env["mover"], "equipment", "move1")
+        self.env.controlTravel(self.env["unit2"], (1, 1, "map"))
+
+        events = list(self.ring)
+        assert len(events) == 4
+        # A cast is recorded after the events of its effects.
+        assert events[0] == ("stat", 4, "mover", "ACT", 5, 6)
+        assert events[1] == ("cast", 4, "empty", "empty", "mover", None)
+        assert events[2] == ("list", 4, "mover", "equipment", "add", "move1")
+        assert events[3][0] == "move"
+        assert self.ring.format()[1] == "[4] init mover"
+
+    def test_binary(self, tmp_path):
+        path = str(tmp_path / "test.trace")
+        with udebs.trace.BinaryFileSink(path) as sink:
+            self.env.sinks.append(sink)
+            self.env.castMove("empty", "empty", "mover", time=0)
+
+        events = list(udebs.trace.BinaryFileSink.read(path))
+        assert events == [("cast", 4, "empty", "empty", "mover", "(#mover STAT ACT) == 5")]
+
+    def test_pickle(self, tmp_path):
+        with udebs.trace.BinaryFileSink(str(tmp_path / "test.trace")) as sink:
+            self.env.sinks.append(sink)
+            new = pickle.loads(pickle.dumps(self.env))
+
+        assert new == self.env
+        assert new.sinks == []
+        assert self.env.sinks == [self.ring, sink]
+
+    def test_future(self):
+        self.env.controlIncrement(self.env["mover"], "ACT", 5)
+        self.ring.clear()
+        assert self.env.castFuture("empty", "empty", "mover") is not None
+        assert len(self.ring) == 0
+
+    def test_copy(self):
+        self.env.controlIncrement(self.env["mover"], "ACT", 5)
+        self.ring.clear()
+        new = self.env.copy()
+        assert new.sinks == []
+        assert new.castMove("empty", "empty", "mover", time=0)
+        assert len(self.ring) == 0
+
+        self.env.cont = new.cont = True
+        self.env.next = new
+        loop = self.env.gameLoop()
+        next(loop)
+        assert next(loop) is new
+        assert new.sinks == [self.ring]
+
+
+class TestCopyOnWrite:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml", cow=True)
+        self.env["double"] = udebs.Entity(self.env, name="double",
+                                          effect=["$caster ACT += 1", "$caster ACT += ($caster STAT ACT)"])
+
+    def test_entities(self):
+        new = self.env.copy()
+        assert new["unit1"] is self.env["unit1"]
+
+        new.controlIncrement(new["unit1"], "ACT", 1)
+        assert new["unit1"] is not self.env["unit1"]
+        assert new["unit1"].ACT == 6
+        assert self.env["unit1"].ACT == 5
+        assert new["unit2"] is self.env["unit2"]
+
+        self.env.controlListAdd(self.env["unit2"], "equipment", "move1")
+        assert new["unit2"].equipment == []
+        assert new == new.copy()
+
+    def test_storage(self):
+        new = self.env.copy()
+        assert new.castMove("unit1", "empty", "double", time=0)
+        assert new["unit1"].ACT == 22
+        assert self.env["unit1"].ACT == 5
+
+    def test_board(self):
+        new = self.env.copy()
+        assert new.map["map"].map[0] is self.env.map["map"].map[0]
+
+        new.controlTravel(new["unit2"], (0, 0, "map"))
+        assert new.map["map"][0, 0] == "unit2"
+        assert self.env.map["map"][0, 0] == "empty"
+        assert self.env["unit2"].loc == (1, 0, "two")
+        assert new.map["map"].map[1] is self.env.map["map"].map[1]
+
+
+class TestUndo:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml")
+        self.env["change"] = udebs.Entity(self.env, name="change", effect=[
+            "$caster ACT += 1",
+            "$caster DESC REPLACE changed",
+            "$caster equipment GETS move1",
+            "$caster inventory LOSES move2",
+            "$caster MOVE (0 0 map)",
+            "#unit2 RECRUIT (1 1 map)",
+            "#unit3 DELETE",
+        ])
+        self.env["bump"] = udebs.Entity(self.env, name="bump", effect="$caster ACT += 1")
+
+    def test_undo(self):
+        before = self.env.copy()
+
+        token = self.env.castMove("unit1", "empty", "change", undoable=True)
+        assert token is not None
+        assert bool(token)
+        assert self.env["unit1"].ACT == 6
+        assert self.env.map["map"][0, 0] == "unit1"
+        assert "unit21" in self.env
+        assert "unit3" not in self.env
+        assert self.env.time == 7
+
+        self.env.undo(token)
+        assert self.env == before
+        assert self.env.map["two"][0, 0] == "unit1"
+        assert self.env["unit1"].loc == (0, 0, "two")
+        assert not self.env._journal
+
+    def test_first_token(self):
+        path = os.path.dirname(__file__)
+        env = udebs.battleStart(path + "/test.xml", revert=0)
+        env["noop"] = udebs.Entity(env, name="noop")
+
+        token = env.castMove("unit1", "unit2", "noop", undoable=True)
+        assert token
+        env.undo(token)
+        assert not env._journal
+
+    def test_nested(self):
+        before = self.env.copy()
+        first = self.env.castMove("unit1", "empty", "change", undoable=True)
+        middle = self.env.copy()
+        second = self.env.castMove("unit1", "empty", "bump", undoable=True)
+        assert self.env["unit1"].ACT == 7
+
+        self.env.undo(second)
+        assert self.env == middle
+        self.env.undo(first)
+        assert self.env == before
+
+    def test_failed(self):
+        before = self.env.copy()
+        assert self.env.castMove("empty", "empty", "move2", undoable=True) is None
+        assert self.env == before
+
+    def test_cow(self):
+        self.env.cow = True
+        child = self.env.copy()
+        token = child.castMove("unit1", "empty", "change", undoable=True)
+        child.undo(token)
+        assert child == self.env
+        assert child["unit1"] is self.env["unit1"]
+
+
+class TestHistory:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml", keyframe=3)
+        self.env["change"] = udebs.Entity(self.env, name="change", effect=[
+            "$caster ACT += 1",
+            "$caster equipment GETS move1",
+            "$caster MOVE (DICE.4 0 map)",
+        ])
+
+    def test_revert(self):
+        copies = [self.env.copy()]
+        for i in range(6):
+            self.env.castMove("unit1", "empty", "change", time=1)
+            copies.append(self.env.copy())
+
+        frames = self.env.state.frames
+        assert any(isinstance(i, udebs.history.Delta) for i in frames)
+        assert not isinstance(frames[0], udebs.history.Delta)
+
+        for i in range(self.env.revert):
+            assert self.env.getRevert(i) == copies[-1 - i]
+        assert self.env.getRevert(self.env.revert) is None
+
+    def test_continue(self):
+        for i in range(3):
+            self.env.castMove("unit1", "empty", "change", time=1)
+
+        old = self.env.getRevert(2)
+        assert old["unit1"].ACT == 6
+        before = old.copy()
+        old.castMove("unit1", "empty", "change", time=1)
+        assert old.getRevert(1) == before
+
+    def test_python(self):
+        path = os.path.dirname(__file__)
+        env = udebs.battleStart(path + "/test.xml")
+        assert env.keyframe == 1
+
+        env["unit1"].ACT = 7
+        env.controlTime(1)
+        before = env.copy()
+        env["unit1"].ACT = 9
+        env.controlTime(1)
+        assert env.getRevert(1) == before
+
+
+class TestHash:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml")
+        self.env["up"] = udebs.Entity(self.env, name="up", effect="$caster ACT += 1")
+        self.env["down"] = udebs.Entity(self.env, name="down", effect="$caster ACT -= 1")
+
+    @staticmethod
+    def fresh(env):
+        new = env.copy()
+        new._zobrist = None
+        for map_ in new.map.values():
+            map_._hash = None
+        return new.getHash()
+
+    def test_incremental(self):
+        start = self.env.getHash()
+        self.env.castMove("unit1", "empty", "up", time=0)
+        self.env.controlListAdd(self.env["unit2"], "equipment", "move1")
+        self.env.controlTravel(self.env["unit2"], (0, 0, "map"))
+        assert self.env.getHash() != start
+        assert self.env.getHash() == self.fresh(self.env)
+
+    def test_transposition(self):
+        start = self.env.getHash()
+        self.env.castMove("unit1", "empty", "up", time=0)
+        self.env.castMove("unit1", "empty", "down", time=0)
+        assert self.env.getHash() == start
+
+        token = self.env.castMove("unit1", "empty", "up", undoable=True)
+        assert self.env.getHash() != start
+        self.env.undo(token)
+        assert self.env.getHash() == start
+
+
+class TestGroupIndex:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml")
+
+    def scan(self, group):
+        return [unit for unit in self.env.values() if group in unit.group]
+
+    def test_all(self):
+        assert self.env.getAll("group1") == self.scan("group1")
+        assert [i.name for i in self.env.getSearch("group3", "group1")] == ["unit3"]
+
+        self.env.controlListAdd(self.env["unit2"], "group", "group1")
+        assert self.env.getAll("group1") == self.scan("group1")
+        assert self.env.getListGroup(self.env["unit1"], "inventory", "move2") == "move1"
+
+        self.env.controlRecruit(self.env["unit3"], (0, 0, "map"))
+        assert self.env.getAll("group1") == self.scan("group1")
+        assert len(self.env.getSearch("group1", "group3")) == 2
+
+        self.env.controlListRemove(self.env["unit1"], "group", "group1")
+        self.env.controlDelete(self.env["unit3"])
+        assert self.env.getAll("group1") == self.scan("group1")
+
+        self.env.controlClear(self.env["unit2"], "group")
+        assert [i.name for i in self.env.getAll("group1")] == ["unit31"]
+
+    def test_undo(self):
+        self.env["delete"] = udebs.Entity(self.env, name="delete", effect="$target DELETE")
+        self.env.getAll("group1")
+
+        token = self.env.castMove("unit1", "unit3", "delete", undoable=True)
+        assert self.env.getAll("group1") == self.scan("group1")
+        assert len(self.env.getAll("group1")) == 1
+
+        self.env.undo(token)
+        assert self.env.getAll("group1") == self.scan("group1")
+        assert len(self.env.getAll("group1")) == 2
+
+        assert self.env.copy().getAll("group1") == self.scan("group1")
+
+    def test_replace(self):
+        self.env.getAll("group1")
+        self.env.controlString([self.env["unit1"]], "group", [])
+        assert self.env.getAll("group1") == self.scan("group1")
+
+        self.env.controlString([self.env["unit2"]], "group", ["group1"])
+        assert self.env.getAll("group1") == self.scan("group1")
+        assert [i.name for i in self.env.getSearch("group1", "group3")] == ["unit3"]
+
+    def test_undo_replace(self):
+        self.env["regroup"] = udebs.Entity(self.env, name="regroup", effect="$caster group REPLACE (group3 group3)")
+        assert self.env.getAll("group3") == self.scan("group3")
+
+        token = self.env.castMove("unit1", "unit2", "regroup", undoable=True)
+        assert self.env.getAll("group3") == self.scan("group3")
+        assert self.env["unit1"] in self.env.getAll("group3")
+
+        self.env.undo(token)
+        assert self.env.getAll("group3") == self.scan("group3")
+        assert self.env["unit1"] not in self.env.getAll("group3")
+
+    def test_python(self):
+        assert [i.name for i in self.env.getAll("group1")] == ["unit1", "unit3"]
+
+        self.env["zz"] = udebs.Entity(self.env, name="zz", group=["group1"])
+        assert [i.name for i in self.env.getAll("group1")] == ["unit1", "unit3", "zz"]
+
+        self.env["unit1"] = udebs.Entity(self.env, name="unit1", group=["group3"])
+        assert self.env.getAll("group1") == self.scan("group1")
+        assert self.env.getAll("group3") == self.scan("group3")
+
+        del self.env["zz"]
+        assert [i.name for i in self.env.getAll("group1")] == ["unit3"]
+
+
+class TestInheritanceCache:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml")
+
+    def scan(self, unit, stat):
+        values = [getattr(unit, stat)]
+        for lst in self.env.rlist:
+            for name in getattr(unit, lst):
+                values.extend(self.scan(self.env[name], stat))
+        return values
+
+    def check(self, name):
+        unit = self.env[name]
+        assert self.env.getStat(unit, "ACT") == sum(self.scan(unit, "ACT"))
+        assert self.env.getStat(unit, "equipment") == [i for j in self.scan(unit, "equipment") for i in j]
+        assert self.env.getStat(unit, "DESC") == next((i for i in self.scan(unit, "DESC") if i is not None), None)
+
+    def test_cache(self):
+        self.check("unit1")
+        assert self.env.getStat(self.env["unit1"], "ACT") == 15
+        assert self.env._ancestors(self.env["unit1"]) == (("group1", "move1", "move2", "move2"), False)
+
+        self.env.controlListRemove(self.env["unit1"], "inventory", "move1")
+        self.check("unit1")
+        assert self.env.getStat(self.env["unit1"], "ACT") == 10
+
+        # Values inherited from mutable entities are read every time.
+        self.env.controlListAdd(self.env["unit3"], "group", "unit1")
+        self.check("unit3")
+        self.env.controlIncrement(self.env["unit1"], "ACT", 2)
+        self.check("unit3")
+
+        # Values inherited from immutable entities are cached.
+        self.env["base"] = udebs.Entity(self.env, name="base", immutable=True, ACT=3, DESC="base")
+        self.env["race"] = udebs.Entity(self.env, name="race", immutable=True, group=["base"], ACT=2)
+        self.env.controlListAdd(self.env["unit2"], "group", "race")
+        self.check("unit2")
+        assert self.env._ancestors(self.env["unit2"]) == (("race", "base"), True)
+        assert self.env._inherited["unit2", "ACT"] == 5
+
+        self.env.controlIncrement(self.env["unit2"], "ACT", 1)
+        assert self.env.getStat(self.env["unit2"], "ACT") == 6
+        self.env.controlListRemove(self.env["unit2"], "group", "race")
+        self.check("unit2")
+
+    def test_undo(self):
+        self.env["clear"] = udebs.Entity(self.env, name="clear", effect="$caster CLEAR inventory")
+        self.check("unit1")
+
+        token = self.env.castMove("unit1", "unit2", "clear", undoable=True)
+        self.check("unit1")
+        assert self.env.getStat(self.env["unit1"], "ACT") == 10
+
+        self.env.undo(token)
+        self.check("unit1")
+        assert self.env.getStat(self.env["unit1"], "ACT") == 15
+
+        new = self.env.copy()
+        new.controlClear(new["unit1"], "inventory")
+        assert new.getStat(new["unit1"], "ACT") == 10
+        assert self.env.getStat(self.env["unit1"], "ACT") == 15
+
+        self.env["regroup"] = udebs.Entity(self.env, name="regroup", effect="$caster group REPLACE (group3 group3)")
+        token = self.env.castMove("unit1", "unit2", "regroup", undoable=True)
+        self.check("unit1")
+        self.env.undo(token)
+        self.check("unit1")
+        assert self.env.getStat(self.env["unit1"], "equipment") == ["1", "1"]
+
+    def test_python(self):
+        self.env["base"] = udebs.Entity(self.env, name="base", immutable=True, ACT=3)
+        self.env.controlListAdd(self.env["unit2"], "group", "base")
+        assert self.env.getStat(self.env["unit2"], "ACT") == 3
+
+        self.env["base"] = udebs.Entity(self.env, name="base", immutable=True, ACT=4)
+        self.check("unit2")
+
+        self.env["unit1"] = udebs.Entity(self.env, name="unit1", ACT=1)
+        self.check("unit1")
+        assert self.env.getStat(self.env["unit1"], "ACT") == 1
+
+
+class TestBulkChange:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml")
+
+    def test_bulk(self):
+        units = [self.env["unit1"], self.env["unit2"], self.env["unit1"], self.env["immune"]]
+        assert self.env.getStat(units, "ACT") == [self.env.getStat(i, "ACT") for i in units]
+        assert self.env.getStat([units, units[1]], "ACT") == [self.env.getStat(units, "ACT"), 0]
+
+        assert self.env.controlIncrement(units, "ACT", 2)
+        assert self.env["unit1"].ACT == 9
+        assert self.env["unit2"].ACT == 2
+
+        assert self.env.controlString(units, "DESC", "bulk")
+        assert self.env["unit1"].DESC == self.env["unit2"].DESC == "bulk"
+        assert self.env["immune"].DESC is None
+        assert not self.env.controlString([self.env["immune"]], "DESC", "bulk")
+
+    def test_undo(self):
+        self.env["bump"] = udebs.Entity(self.env, name="bump", effect=["ALL.group1 ACT += 1", "ALL.group1 DESC REPLACE x"])
+
+        token = self.env.castMove("unit1", "unit2", "bump", undoable=True)
+        assert [(i.ACT, i.DESC) for i in self.env.getAll("group1")] == [(6, "x"), (1, "x")]
+        self.env.undo(token)
+        assert [(i.ACT, i.DESC) for i in self.env.getAll("group1")] == [(5, "description"), (0, None)]
+
+    def test_logging(self, caplog):
+        units = [self.env["unit1"], self.env["unit2"]]
+        self.env.logging = True
+        assert self.env._bulk(units) is not None
+
+        with caplog.at_level(logging.INFO):
+            assert self.env._bulk(units) is None
+            self.env.controlIncrement(units, "ACT", 2)
+        assert "unit1 ACT changed by 2 is now 17" in caplog.messages
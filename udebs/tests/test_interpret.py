@@ -85,6 +85,16 @@ class TestBase:
         assert self.env.castSingle("if 1 0 2") == 0
         assert self.env.castSingle("if 0 0 2") == 2
 
+    def test_lazy(self):
+        storage = {"a": 1, "b": 0}
+        env = {"storage": storage, "self": self.env}
+        eval(interpret.Script("if $a (x = 1) (y = 2)").code, interpret.Variables.env, env)
+        assert storage == {"a": 1, "b": 0, "x": 1}
+
+        assert eval(interpret.Script("$a || (z = 1)").code, interpret.Variables.env, env) is True
+        assert eval(interpret.Script("$b && $y").code, interpret.Variables.env, env) is False
+        assert "z" not in storage
+
     def test_var(self):
         # not sure how to test if this actually worked
         assert self.env.castSingle("1 = test")
@@ -129,3 +139,171 @@ class TestBase:
 
     def test_len(self):
         assert self.env.castSingle("length (0 0 0 1)") == 4
+
+
+class TestScriptCache:
+    def test_shared_compile(self):
+        interpret.script_cache.clear()
+        before = interpret.script_cache.info()
+        one = interpret.Script("1 in (1 0)")
+        two = interpret.Script("1 in (1 0)")
+        after = interpret.script_cache.info()
+
+        assert one is not two
+        assert one.code is two.code
+        assert after.misses == before.misses + 1
+        assert after.hits == before.hits + 1
+
+    def test_eviction(self):
+        cache = interpret.ScriptCache(maxsize=2)
+        cache.put("one", 1)
+        cache.put("two", 2)
+        assert cache.get("one") == 1
+        cache.put("three", 3)
+
+        assert "two" not in cache
+        assert "one" in cache
+        assert cache.info().evictions == 1
+        assert cache.get("two") is None
+        assert cache.info().misses == 1
+
+
+class TestParser:
+    def test_tokenize(self):
+        tokens = list(interpret.tokenize("#unit.NAME (1 'a b')"))
+        assert [i[0] for i in tokens] == ["word", "dot", "word", "space", "open", "word", "space", "quote", "close"]
+        assert tokens[7] == ("quote", "'a b'", 14)
+
+    def test_parse(self):
+        expr = interpret.parse("one #(two three).four")
+        assert [i.text for i in expr.words] == ["one", "#(two three).four"]
+
+        dotted = expr.words[1]
+        assert [i.text for i in dotted.segments] == ["#(two three)", "four"]
+        assert dotted.segments[1].pos == 17
+
+        group = dotted.segments[0].strip().group()
+        assert group.text == "two three"
+        assert group.pos == 6
+
+    def test_error_position(self):
+        with raises(errors.UdebsSyntaxError) as e:
+            interpret.interpret("one (two three")
+        assert e.value.pos == 4
+
+        with raises(errors.UdebsSyntaxError) as e:
+            interpret.interpret("one two..three")
+        assert e.value.pos == 8
+
+
+class TestOptimize:
+    def test_fold(self):
+        assert interpret.Script("+ 1 2").interpret == "3"
+        assert interpret.Script("- 3").interpret == "-3"
+        assert interpret.Script("length 'abc'").interpret == "3"
+        assert interpret.Script("1 in (1 0)").interpret == "True"
+        assert interpret.Script("print (1 + 2)").interpret == "print_inner(3)"
+
+    def test_dead_argument(self):
+        assert interpret.Script("if true x y").interpret == "'x'"
+        assert interpret.Script("if false (#a STAT b) (3 + 4)").interpret == "7"
+        assert interpret.Script("if (1 > 0) $a (x = 3)").interpret == "storage.__getitem__('a')"
+
+    def test_not_folded(self):
+        assert interpret.Script("1 / 0").interpret == "operator.floordiv(1,0)"
+        assert interpret.Script("false && (x = 1)").interpret == "False"
+        assert "logicand" in interpret.Script("$a && (x = 1)").interpret
+
+    def test_register_pure(self):
+        @udebs.register({"args": ["$1"], "pure": True})
+        def double(arg):
+            return arg * 2
+
+        @udebs.register({"args": ["$1"]})
+        def triple(arg):
+            return arg * 3
+
+        @udebs.register({"args": ["$1", "$2"], "pure": True})
+        def first(one, two):
+            return one
+
+        assert interpret.Script("double 4").interpret == "8"
+        assert interpret.Script("triple 4").interpret == "triple(4)"
+        assert interpret.Script("first $a 4").interpret == "storage.__getitem__('a')"
+        # Getters may raise, so they are never folded away.
+        assert interpret.Script("first $a $b").interpret == "first(storage.__getitem__('a'),storage.__getitem__('b'))"
+        assert interpret.Script("first 4 #zz").interpret != "4"
+
+        # Side effects are never dropped.
+        assert "setvar" in interpret.Script("first 1 (x = 3)").interpret
+
+
+class TestRegistry:
+    def test_version(self):
+        before = interpret.Variables.version
+        assert interpret.interpret("undefined-keyword 1") == "('undefined-keyword',1)"
+
+        @udebs.register({"args": ["$1"]}, name="undefined-keyword")
+        def keyword(arg):
+            return arg
+
+        assert interpret.Variables.version != before
+        assert interpret.Script("undefined-keyword 1").interpret == "keyword(1)"
+        del interpret.Variables.modules["undefined-keyword"]
+
+    def test_isolated(self):
+        registry = interpret.Variables.copy()
+
+        @registry.register({"args": ["$1"], "pure": True})
+        def private(arg):
+            return arg + 1
+
+        assert "private" in registry.modules
+        assert "private" not in interpret.Variables.modules
+        assert interpret.Script("private 1", registry=registry).interpret == "2"
+        assert interpret.interpret("private 1") == "('private',1)"
+
+        path = os.path.dirname(__file__)
+        env = udebs.battleStart(path + "/test.xml", registry=registry)
+        assert env.registry is registry
+        assert env.castLambda("2 == (private 1)") is None
+
+
+class TestSpecialize:
+    def setup(self):
+        path = os.path.dirname(__file__)
+        self.env = udebs.battleStart(path + "/test.xml")
+
+    def test_specialize(self):
+        script = interpret.Script("#unit1 STAT ACT", schema=self.env.schema)
+        assert script.interpret == "_getStatSum(self, getEntity(self, 'unit1'), 'ACT')"
+
+        script = interpret.Script("$caster STAT inventory", schema=self.env.schema)
+        assert script.interpret == "_getStatList(self, storage.__getitem__('caster'), 'inventory')"
+
+        script = interpret.Script("#unit1 STAT DESC", schema=self.env.schema)
+        assert script.interpret == "_getStatString(self, getEntity(self, 'unit1'), 'DESC')"
+
+        # Unknown stats keep the generic getter and its error.
+        script = interpret.Script("#unit1 STAT nothing", schema=self.env.schema)
+        assert script.interpret.startswith("getStat(")
+
+        # Unknown entities keep the error getEntity raises.
+        script = interpret.Script("#nobody STAT ACT", schema=self.env.schema)
+        with raises(errors.UndefinedSelectorError):
+            eval(script.code, interpret.Variables.env, {"storage": {}, "self": self.env})
+
+    def test_values(self):
+        local = {"storage": {"caster": self.env["unit1"]}, "self": self.env}
+        for string in ("#unit1 STAT ACT", "$caster STAT inventory", "#unit1 STAT DESC", "$caster GROUP"):
+            generic = interpret.Script(string)
+            special = interpret.Script(string, schema=self.env.schema)
+            assert generic.interpret != special.interpret
+            assert eval(generic.code, interpret.Variables.env, local) == eval(special.code, interpret.Variables.env, local)
+
+    def test_entity_only(self):
+        for string in ("$target.NAME != immune", "($target STAT ACT) > (#unit1 STAT ACT)"):
+            assert interpret.entity_only([interpret.Script(string, schema=self.env.schema)])
+
+        for string in ("DISTANCE.x == 0", "$target.LOC == (1 1)", "DICE.3 > 1"):
+            assert not interpret.entity_only([interpret.Script(string)])
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+import udebs
+from udebs.treesearch import AlphaBeta, BruteForce, State
+
+game = """
+<udebs>
+<config><logging>False</logging><immutable>True</immutable></config>
+<definitions><stats><STONES /></stats></definitions>
+<entities>
+    <pile immutable="False"><STONES>{stones}</STONES></pile>
+    <take>
+        <require>(#pile STAT STONES) >= $target.STAT.increment</require>
+        <effect>
+            <i>#pile STONES -= $target.STAT.increment</i>
+            <i>CAST #empty #win</i>
+        </effect>
+    </take>
+    <win>
+        <require>(#pile STAT STONES) == 0</require>
+        <effect>EXIT 1</effect>
+    </win>
+    <one><increment>1</increment></one>
+    <two><increment>2</increment></two>
+</entities>
+</udebs>
+"""
+
+
+registry = udebs.interpret.Variables.copy()
+
+
+@registry.register({"args": ["$1"]})
+def taken(move):
+    return move.increment
+
+
+class Nim(State):
+    """Players take one or two stones in turn, whoever takes the last stone wins."""
+
+    def legalMoves(self):
+        for amount in ("one", "two"):
+            yield "empty", amount, "take"
+
+    def endState(self):
+        return self.value
+
+
+class NimBruteForce(Nim, BruteForce):
+    pass
+
+
+class NimAlphaBeta(Nim, AlphaBeta):
+    def substates(self):
+        for child, move in State.substates(self):
+            yield child
+
+
+class TestParallel:
+    def test_brute_force(self):
+        for stones in (6, 7):
+            state = udebs.battleStart(game.format(stones=stones), field=NimBruteForce)
+            assert state.parallel_result(processes=2) == state.copy().result() == (-1 if stones % 3 == 0 else 1)
+
+    def test_alpha_beta(self):
+        inf = float("inf")
+        for stones in (6, 7):
+            state = udebs.battleStart(game.format(stones=stones), field=NimAlphaBeta)
+            expected = state.copy().result(-inf, inf, OrderedDict())
+            assert state.parallel_result(processes=2) == expected == (-1 if stones % 3 == 0 else 1)
+
+    def test_registry(self):
+        nim = game.replace("$target.STAT.increment", "(taken $target)")
+        for stones in (6, 7):
+            state = udebs.battleStart(nim.format(stones=stones), field=NimBruteForce, registry=registry)
+            assert state.registry is registry
+            assert state.parallel_result(processes=2) == state.copy().result() == (-1 if stones % 3 == 0 else 1)
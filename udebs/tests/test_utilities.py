@@ -14,6 +14,11 @@ class TestBattleStart:
 
         assert f.time > 0
 
+    def test_hash_key(self):
+        # Fixed across processes, unlike hash on strings.
+        assert udebs.utilities.hash_key("unit1", "ACT", 5) == 0x495025d0259f32bd
+        assert udebs.utilities.hash_key("unit1", "ACT", 5) != udebs.utilities.hash_key("unit1", "ACT", 6)
+
     def test_register(self):
         @udebs.register({"args": ["$1", "$2"]})
         def ADDITION1(one, two):
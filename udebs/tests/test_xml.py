@@ -1,5 +1,6 @@
 import udebs
 import os
+import marshal
 from udebs.board import Board
 
 
@@ -79,3 +80,48 @@ class TestBattleWrite:
 
         assert env1 == env2
         os.remove(path2)
+
+
+class TestBundle:
+    def test_bundle(self):
+        path = os.path.dirname(__file__) + "/test.xml"
+        path2 = os.path.dirname(__file__) + "/test.udb"
+
+        env1 = udebs.battleStart(path, bundle=path2)
+        assert os.path.exists(path2)
+
+        udebs.interpret.script_cache.clear()
+        env2 = udebs.battleStart(path, bundle=path2)
+        assert env1 == env2
+        assert env2["move2"].require[0].code is udebs.interpret.script_cache.get((udebs.interpret.Variables.version, "#move2 ACT == 5", False, env2.schema))[1]
+        os.remove(path2)
+
+    def test_stale(self):
+        path = os.path.dirname(__file__) + "/test.xml"
+        path2 = os.path.dirname(__file__) + "/test.udb"
+
+        key = (udebs.bundle.content_hash(path), udebs.bundle.signature())
+        udebs.battleStart(path, bundle=path2)
+        assert udebs.bundle.load(path2, key)
+        assert not udebs.bundle.load(path2, (udebs.bundle.content_hash("<udebs />"), key[1]))
+
+        with open(path2, "wb") as f:
+            f.write(b"garbage")
+        assert not udebs.bundle.load(path2, key)
+
+        for data in [(udebs.bundle.FORMAT, 5, []), (udebs.bundle.FORMAT, key, [1]), (udebs.bundle.FORMAT, key, [(1, 2)])]:
+            with open(path2, "wb") as f:
+                f.write(marshal.dumps(data))
+            assert not udebs.bundle.load(path2, key)
+
+        udebs.battleStart(path, bundle=path2)
+        assert udebs.bundle.load(path2, key)
+        os.remove(path2)
+
+    def test_unwritable(self):
+        path = os.path.dirname(__file__) + "/test.xml"
+        path2 = os.path.dirname(__file__) + "/missing/test.udb"
+
+        env = udebs.battleStart(path, bundle=path2)
+        assert env == udebs.battleStart(path)
+        assert not os.path.exists(path2)
@@ -0,0 +1,152 @@
+"""
+Structured event tracing.
+
+An Instance created with sinks=[...] passes every event to each sink as a plain tuple.
+Nothing is formatted until the trail is read, and with no sinks nothing is built at all.
+Copies of the instance start without sinks, so moves tried in a tree search are not recorded.
+
+.. code-block:: python
+
+    ring = udebs.trace.RingBufferSink(10000)
+    field = udebs.battleStart("game.xml", logging=False, sinks=[ring])
+    ...
+    for line in ring.format():
+        print(line)
+
+Events all start with (kind, time). The remaining fields by kind are:
+
+* cast - caster, target, move, failed require or None. Sent once the move has finished, so it follows
+  the events of the move's effects.
+* stat - target, stat, old value, new value.
+* list - target, list, operation ("add", "remove", "clear" or "shuffle"), entry or None.
+* move - entity, old location, new location.
+* delay - delayed script as it was written.
+
+Entities are recorded by name, or by location for immutable entities on a map.
+"""
+import logging
+import marshal
+from collections import deque
+
+CAST = "cast"
+STAT = "stat"
+LIST = "list"
+MOVE = "move"
+DELAY = "delay"
+
+
+def format_event(event: tuple) -> str:
+    """Converts an event into the same message udebs logging would have shown."""
+    kind, time, *fields = event
+    if kind == CAST:
+        caster, target, move, failed = fields
+        if caster == target == "empty":
+            message = f"init {move}"
+        elif target == "empty":
+            message = f"{caster} uses {move}"
+        else:
+            message = f"{caster} uses {move} on {target}"
+        if failed is not None:
+            message += f" failed because {failed}"
+    elif kind == STAT:
+        target, stat, old, new = fields
+        message = f"{target} {stat} changed from {old} to {new}"
+    elif kind == LIST:
+        target, lst, operation, entry = fields
+        if operation == "add":
+            message = f"{entry} added to {target} {lst}"
+        elif operation == "remove":
+            message = f"{entry} removed from {target} {lst}"
+        elif operation == "clear":
+            message = f"{target} {lst} has been cleared"
+        else:
+            message = f"{target} {lst} has been shuffled"
+    elif kind == MOVE:
+        entity, old, new = fields
+        message = f"{entity} has moved from {old} to {new}"
+    elif kind == DELAY:
+        message = f"delayed effect {fields[0]} fired"
+    else:
+        message = " ".join(str(i) for i in fields)
+
+    return f"[{time}] {message}"
+
+
+class RingBufferSink:
+    """Keeps the most recent maxlen events in memory."""
+
+    def __init__(self, maxlen: int = 10000):
+        self.events = deque(maxlen=maxlen)
+
+    def __call__(self, event: tuple) -> None:
+        self.events.append(event)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def clear(self):
+        self.events.clear()
+
+    def format(self) -> list[str]:
+        return [format_event(i) for i in self.events]
+
+
+def _plain(value):
+    """Makes a value marshal can store. Entities and other objects are stored as strings."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (tuple, list)):
+        return tuple(_plain(i) for i in value)
+    return str(value)
+
+
+class BinaryFileSink:
+    """Appends events to a file in marshal format. Read them back with BinaryFileSink.read."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "ab")
+
+    def __call__(self, event: tuple) -> None:
+        try:
+            data = marshal.dumps(event)
+        except ValueError:
+            data = marshal.dumps(_plain(event))
+        self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def read(path: str):
+        """Yields every event stored in path."""
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    yield marshal.load(f)
+                except EOFError:
+                    return
+
+
+class LoggingSink:
+    """Formats events and passes them to a logger."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logging.getLogger() if logger is None else logger
+        self.level = level
+
+    def __call__(self, event: tuple) -> None:
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, format_event(event))
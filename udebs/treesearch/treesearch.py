@@ -1,5 +1,7 @@
 import math
+import multiprocessing
 import time
+from collections import OrderedDict
 from udebs.instance import Instance
 from udebs.treesearch.utilities import cache, alpha_beta_cache
 
@@ -19,9 +21,23 @@ class State(Instance):
                 yield new_state, move
                 new_state = self.copy()
 
+    def inplace_substates(self):
+        """Same as substates except each move is applied to this state and undone before the next one.
+
+        Every child yielded is this state itself, so it must be finished with before the loop continues.
+        To use it in a solver set substates = State.inplace_substates on the subclass.
+        """
+        for move in self.legalMoves():
+            token = self.castMove(*move, undoable=True)
+            if token is not None:
+                try:
+                    yield self, move
+                finally:
+                    self.undo(token)
+
     def hash(self):
-        """Implement this function if you plan on using treesearch.cache"""
-        raise NotImplementedError
+        """Key used by treesearch.cache and alpha_beta_cache. Defaults to Instance.getHash."""
+        return self.getHash()
 
     def legalMoves(self):
         """This function must be implemented. Iterate over all (caster, target, move) tuples that are valid children of current node."""
@@ -56,6 +72,25 @@ class BruteForce(State):
 
         return max(results)
 
+    def parallel_result(self, processes=None):
+        """Same as result, but each child of this state is solved in a separate process, see parallel_pool."""
+        value = self.endState()
+        if value is not None:
+            return -abs(value)
+
+        results = []
+        children = []
+        for child, e in self.substates():
+            if child is e:
+                results.append(-child)
+            else:
+                children.append(child.copy() if child is self else child)
+
+        with parallel_pool(processes) as pool:
+            results.extend(pool.imap_unordered(_brute_force_child, children))
+
+        return max(results)
+
 
 class AlphaBeta(State):
     """Example implementation of an alphabeta minimax solver."""
@@ -77,6 +112,76 @@ class AlphaBeta(State):
 
         return current
 
+    def parallel_result(self, alpha=-float("inf"), beta=float("inf"), processes=None):
+        """
+        Same as result, but each child of this state is searched in a separate process, see parallel_pool.
+
+        Workers share the best value found so far. Each child is searched with the best value
+        known when its search starts, so later children are cut off as if they were searched in order.
+        """
+        value = self.value
+        if value is not None:
+            return -abs(value)
+
+        children = [child.copy() if child is self else child for child in self.substates()]
+
+        current = -float("inf")
+        with parallel_pool(processes, alpha) as pool:
+            for computed in pool.imap_unordered(_alpha_beta_child, [(child, alpha, beta) for child in children]):
+                if computed > current:
+                    current = computed
+                    if current >= beta:
+                        break
+
+        return current
+
+
+# ---------------------------------------------------
+#                 Parallel search                  -
+# ---------------------------------------------------
+# Best value found at the root of a parallel search, shared by every worker.
+_bound = None
+# Transposition table each worker keeps between children, see alpha_beta_cache.
+_storage = None
+
+
+def _start_worker(bound):
+    global _bound, _storage
+    _bound = bound
+    _storage = OrderedDict()
+
+
+def parallel_pool(processes=None, alpha=-float("inf")):
+    """
+    Returns a process pool for parallel_result, with processes workers (default os.cpu_count()).
+
+    Children are pickled to the workers, so states must be picklable. Subclasses of State and
+    keywords registered with udebs.register must be importable by the workers, by being defined in a
+    module rather than an interactive session.
+    """
+    bound = multiprocessing.Value("d", alpha)
+    return multiprocessing.Pool(processes, _start_worker, (bound,))
+
+
+def _brute_force_child(child):
+    return -child.result()
+
+
+def _alpha_beta_child(args):
+    child, alpha, beta = args
+    if _bound.value > alpha:
+        alpha = _bound.value
+        if alpha >= beta:
+            # Another child already caused a cutoff.
+            return alpha
+
+    computed = -child.result(-beta, -alpha, _storage)
+    with _bound.get_lock():
+        if computed > _bound.value:
+            _bound.value = computed
+
+    return computed
+
 
 class MarkovChain(State):
     """Example implementation of a markov chain calculator."""
@@ -2,6 +2,7 @@ import itertools
 import time
 import traceback
 import functools
+from hashlib import blake2b
 
 # ---------------------------------------------------
 #                  Utilities                       -
@@ -28,6 +29,7 @@ def modify_state(state, entities=None, logging=True, revert=True):
                 setattr(new, name, value)
 
             clone[key] = new
+            clone._zobrist = None
 
     return clone
 
@@ -53,6 +55,15 @@ class Timer:
         return str(self.total)
 
 
+def hash_key(*key) -> int:
+    """
+    64 bit hash of key for incremental state hashes. XOR two keys to swap one value for another.
+
+    Unlike hash, the result does not change between processes, so hashes can be compared across them.
+    """
+    return int.from_bytes(blake2b(repr(key).encode(), digest_size=8).digest(), "little")
+
+
 def no_recurse(f):
     """Wrapper function that forces a function to return True if it recurse."""
 